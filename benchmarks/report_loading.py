@@ -0,0 +1,127 @@
+"""Benchmark loading large verifytypes reports.
+
+Generates a synthetic report and loads it in a fresh process per method,
+reporting the load time and the peak resident set size of that process:
+
+- `text`: read the file as text and validate with pydantic (the original path)
+- `bytes`: validate the raw file bytes with pydantic, skipping the text decode
+- `streaming`: `load_report()`, streaming the symbols from the memory-mapped file
+
+Run with `uv run python benchmarks/report_loading.py [symbols]`.
+"""
+
+import json
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any
+
+METHODS = ("text", "bytes", "streaming")
+
+
+def generate_report(path: Path, symbol_count: int) -> None:
+    rng = random.Random(42)
+    modules = ["pkg"] + [f"pkg.mod{i}" for i in range(250)]
+    modules += [f"pkg.mod{i}.sub{j}" for i in range(250) for j in range(4)]
+    counts = {"withKnownType": 0, "withAmbiguousType": 0, "withUnknownType": 0}
+    symbols: list[dict[str, Any]] = []
+    for i in range(symbol_count):
+        known = rng.random() < 0.6
+        symbols.append(
+            {
+                "category": "method",
+                "name": f"{rng.choice(modules)}.Class{i % 100}.method{i}",
+                "referenceCount": 1,
+                "isExported": rng.random() < 0.8,
+                "isTypeKnown": known,
+                "isTypeAmbiguous": not known and rng.random() < 0.3,
+                "diagnostics": []
+                if known
+                else [
+                    {
+                        "file": f"/src/pkg/mod{i % 250}.py",
+                        "severity": "error",
+                        "message": 'Type of parameter "x" is partially unknown',
+                        "range": {
+                            "start": {"line": i % 1000, "character": 8},
+                            "end": {"line": i % 1000, "character": 16},
+                        },
+                    }
+                ],
+            }
+        )
+    report = {
+        "version": "1.1.391",
+        "time": "1735043053980",
+        "generalDiagnostics": [],
+        "summary": {
+            "filesAnalyzed": len(modules),
+            "errorCount": 0,
+            "warningCount": 0,
+            "informationCount": 0,
+            "timeInSec": 1.0,
+        },
+        "typeCompleteness": {
+            "packageName": "pkg",
+            "moduleName": "pkg",
+            "ignoreUnknownTypesFromImports": True,
+            "exportedSymbolCounts": counts,
+            "otherSymbolCounts": counts,
+            "missingFunctionDocStringCount": 0,
+            "missingClassDocStringCount": 0,
+            "missingDefaultParamCount": 0,
+            "completenessScore": 0.5,
+            "modules": [{"name": name} for name in modules],
+            "symbols": symbols,
+        },
+    }
+    with path.open("w") as f:
+        json.dump(report, f, indent=4)
+
+
+def load(method: str, path: Path) -> None:
+    """Load the report with the given method, then print time and peak RSS"""
+    from pyright_analysis import schema
+
+    from pyright_analysis_action._report import load_report
+
+    start = time.perf_counter()
+    match method:
+        case "text":
+            schema.PyrightJsonResults.model_validate_json(path.read_text())
+        case "bytes":
+            schema.PyrightJsonResults.model_validate_json(path.read_bytes())
+        case _:
+            load_report(path)
+    elapsed = time.perf_counter() - start
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"{elapsed:.3f} {peak_rss:.1f}")
+
+
+def main() -> None:
+    if sys.argv[1:2] == ["--load"]:
+        return load(sys.argv[2], Path(sys.argv[3]))
+
+    symbol_count = int(sys.argv[1]) if len(sys.argv) > 1 else 500_000
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = Path(tmpdir) / "report.json"
+        generate_report(path, symbol_count)
+        size = path.stat().st_size / 2**20
+        print(f"Report with {symbol_count:,} symbols, {size:,.1f} MiB")
+        for method in METHODS:
+            result = subprocess.run(
+                [sys.executable, __file__, "--load", method, str(path)],
+                check=True,
+                capture_output=True,
+                text=True,
+            )
+            elapsed, peak_rss = map(float, result.stdout.split())
+            print(f"{method:<10} {elapsed:>8.2f} s {peak_rss:>10,.1f} MiB peak RSS")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+"""Micro-benchmark for the smokeshow key search inner loop.
+
+Compares the number of attempts per second made by a single process, for the
+original per-attempt `os.urandom()` loop and the batched search used by the
+key search workers.
+
+Run with `uv run python benchmarks/smokeshow_key.py [attempts]`.
+"""
+
+import os
+import sys
+import time
+from collections.abc import Callable
+from hashlib import sha256
+
+from pyright_analysis_action.smokeshow import _search_key
+
+# Never finds a hit, so every variant makes the full number of attempts.
+UNREACHABLE = 256
+
+
+def per_attempt_urandom(attempts: int) -> None:
+    """The search loop as it was before batching"""
+    prefixes = (bytes([0, 0, 0, 0, 0, 0, 0, 0]),)
+    for _ in range(attempts):
+        seed = os.urandom(50)
+        if sha256(seed).digest().startswith(prefixes):
+            break
+
+
+def batched(attempts: int) -> None:
+    _search_key(UNREACHABLE, attempts)
+
+
+def measure(name: str, search: Callable[[int], None], attempts: int) -> None:
+    start = time.perf_counter()
+    search(attempts)
+    elapsed = time.perf_counter() - start
+    print(f"{name:<22} {attempts / elapsed:>14,.0f} attempts/s")
+
+
+def main() -> None:
+    attempts = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    measure("per-attempt urandom", per_attempt_urandom, attempts)
+    measure("batched", batched, attempts)
+
+
+if __name__ == "__main__":
+    main()
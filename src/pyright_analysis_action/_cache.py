@@ -0,0 +1,113 @@
+# Content-addressed cache of rendered reports
+import hashlib
+import json
+import os
+import shutil
+import threading
+from importlib.metadata import version
+from pathlib import Path
+from typing import NamedTuple
+
+DEFAULT_MAX_SIZE = 64 * 1024 * 1024
+PACKAGE_NAME, HTML_PAGE, PREVIEW = "package_name", "index.html", "preview.svg"
+
+
+class RenderedReport(NamedTuple):
+    package_name: str
+    html_page: Path  # the page is large, so it is passed around as a file
+    preview: bytes
+
+
+class RenderCache:
+    """Rendered HTML pages and preview images, keyed by a hash of their inputs
+
+    Each entry is a directory named after its key. Entries are touched when
+    they are read, and once the cache grows beyond `max_size` bytes the least
+    recently used entries are removed. Point the cache at a directory that is
+    persisted between workflow runs (e.g. with `actions/cache`) to skip
+    parsing and rendering reports that have been seen before.
+
+    The HTML page of an entry is returned as the path of the file in the
+    cache, so a cache instance never evicts the entries it has returned.
+    Entries are read and stored from worker threads, so access is serialised
+    with a lock; entries that another process removes while evicting are
+    skipped.
+
+    """
+
+    def __init__(self, directory: Path, max_size: int = DEFAULT_MAX_SIZE) -> None:
+        self.directory = directory
+        self.max_size = max_size
+        self._in_use: set[str] = set()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(report: Path, **inputs: str | None) -> str:
+        """Hash the report contents, the render inputs and the library versions"""
+        from . import __version__
+
+        with report.open("rb") as file:
+            digest = hashlib.file_digest(file, "sha256")
+        versions = {
+            "pyright-analysis-action": __version__,
+            "pyright-analysis": version("pyright-analysis"),
+            "plotly": version("plotly"),
+        }
+        digest.update(json.dumps([versions, inputs], sort_keys=True).encode())
+        return digest.hexdigest()
+
+    def get(self, key: str) -> RenderedReport | None:
+        with self._lock:
+            return self._get(key)
+
+    def _get(self, key: str) -> RenderedReport | None:
+        entry = self.directory / key
+        html_page = entry / HTML_PAGE
+        try:
+            rendered = RenderedReport(
+                (entry / PACKAGE_NAME).read_text(),
+                html_page,
+                (entry / PREVIEW).read_bytes(),
+            )
+            html_page.stat()
+        except FileNotFoundError:
+            return None
+        self._in_use.add(key)
+        os.utime(entry)
+        return rendered
+
+    def put(self, key: str, rendered: RenderedReport) -> None:
+        with self._lock:
+            self._put(key, rendered)
+            self._evict()
+
+    def _put(self, key: str, rendered: RenderedReport) -> None:
+        entry = self.directory / key
+        tmp = self.directory / f".{key}.tmp"
+        shutil.rmtree(tmp, ignore_errors=True)
+        tmp.mkdir(parents=True)
+        (tmp / PACKAGE_NAME).write_text(rendered.package_name)
+        shutil.copyfile(rendered.html_page, tmp / HTML_PAGE)
+        (tmp / PREVIEW).write_bytes(rendered.preview)
+        shutil.rmtree(entry, ignore_errors=True)
+        tmp.rename(entry)
+
+    def _evict(self) -> None:
+        """Remove least recently used entries until the cache fits max_size"""
+        entries: list[tuple[float, int, Path]] = []
+        for entry in self.directory.iterdir():
+            if entry.name.startswith(".") or not entry.is_dir():
+                continue
+            try:
+                size = sum(f.stat().st_size for f in entry.iterdir())
+                entries.append((entry.stat().st_mtime, size, entry))
+            except FileNotFoundError:  # removed by another process
+                continue
+        total = sum(size for _, size, _ in entries)
+        for _, size, entry in sorted(entries):
+            if total <= self.max_size:
+                break
+            if entry.name in self._in_use:
+                continue
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
@@ -1,7 +1,9 @@
 # GraphQL queries and the type definitions for their input and output data
+import asyncio
 import datetime
+import re
 from collections.abc import AsyncIterator, Mapping
-from typing import Any, ClassVar, TypedDict, cast
+from typing import Any, ClassVar, NotRequired, TypedDict, cast
 
 from githubkit import GitHub
 
@@ -10,6 +12,13 @@ type JSONScalar = str | bool | float | int | None
 type JSONArray = list[JSONAny]
 type JSONObject = dict[str, JSONAny]
 
+# A query operation, with its variable definitions and top-level selection
+_OPERATION = re.compile(
+    r"^\s*query\s+\w+\s*(?:\((?P<variables>[^)]*)\))?\s*\{(?P<selection>.*)\}\s*$",
+    re.DOTALL,
+)
+_VARIABLE = re.compile(r"\$(\w+)")
+
 
 def _unwrap_singles(obj: JSONAny, *drop: str) -> JSONAny:
     """Remove single-key dictionary wrappers"""
@@ -44,6 +53,59 @@ class GQLPagedQuery[S: Mapping[str, Any], T](GQLQueryBase[S, T]):
         return self._execute_paged(variables)
 
 
+class GQLBatch:
+    """Execute independent queries in a single GraphQL request
+
+    Each query added to the batch becomes an aliased top-level field of one
+    merged query document, with its variables prefixed by the same alias to
+    keep them apart. The results are split back out per query when the batch
+    is executed, saving a round trip to the API for each additional query.
+
+    Queries must select a single top-level field and can't be paged.
+
+    """
+
+    def __init__(self, client: GitHub[Any]) -> None:
+        self._client = client
+        self._queries: list[
+            tuple[GQLQuery[Any, Any], Mapping[str, Any], asyncio.Future[Any]]
+        ] = []
+
+    def add[S: Mapping[str, Any], T](
+        self, query: GQLQuery[S, T], variables: S
+    ) -> asyncio.Future[T]:
+        """Add a query, returning a future for its result"""
+        future: asyncio.Future[T] = asyncio.get_running_loop().create_future()
+        self._queries.append((query, variables, future))
+        return future
+
+    def document(self) -> tuple[str, dict[str, Any]]:
+        """The merged query document, and the variables to go with it"""
+        definitions: list[str] = []
+        selections: list[str] = []
+        variables: dict[str, Any] = {}
+        for index, (query, values, _) in enumerate(self._queries):
+            operation = query._query  # pyright: ignore[reportPrivateUsage]
+            if (match := _OPERATION.match(operation)) is None:
+                raise ValueError(f"Can't batch {type(query).__name__}")
+            alias = f"q{index}"
+            prefixed = rf"${alias}_\1"
+            if match["variables"]:
+                definitions.append(_VARIABLE.sub(prefixed, match["variables"].strip()))
+            selection = _VARIABLE.sub(prefixed, match["selection"].strip())
+            selections.append(f"{alias}: {selection}")
+            variables |= {f"{alias}_{name}": value for name, value in values.items()}
+        signature = f"({', '.join(definitions)})" if definitions else ""
+        body = "\n".join(selections)
+        return f"query Batch{signature} {{\n{body}\n}}", variables
+
+    async def execute(self) -> None:
+        document, variables = self.document()
+        result = await self._client.graphql.arequest(document, variables)
+        for index, (*_, future) in enumerate(self._queries):
+            future.set_result(_unwrap_singles(result[f"q{index}"]))
+
+
 class _MutationInput[T](TypedDict):
     input: T
 
@@ -77,14 +139,11 @@ class _SparsePullRequest(TypedDict):
     id: str
     headRefOid: str
     headRepository: _Node
-    timelineItems: _Connection[_SparseHeadRefForcePushedEvent]
-    commits: _Connection[_SparsePullRequestCommit]
 
 
 class _PrsForBranchVariables(TypedDict):
     repository_id: str
     headRefName: str
-    since: datetime.datetime | None
 
 
 class PrsForBranchQuery(GQLQuery[_PrsForBranchVariables, list[_SparsePullRequest]]):
@@ -92,21 +151,18 @@ class PrsForBranchQuery(GQLQuery[_PrsForBranchVariables, list[_SparsePullRequest
 
     This queries for PRs with a given branch name against a given repository.
     This initially filters on the base repository node id plus the name of the
-    head branch being merged. Per PR we include the first force-push events added
-    after the source workflow was created, and the last 100 commits in the PR
-    branch. The returned information can then be used to narrow down the exact
-    PR, because we can then confirm the head repository matches, and we can look
-    for an exact head reference match against either the last known head sha or
-    a known commit sha.
+    head branch being merged. Per PR only the head repository and current head
+    sha are included, which is usually enough to narrow down the exact PR; use
+    `PullRequestHistoryQuery` to fetch the commit history of any PRs that are
+    still ambiguous after that.
 
     There is no pagination; if there are more than 100 PRs that all have the
-    same head branch name in a single repository, and we can't find a matching
-    head sha in the 100 most-recent commits, then something really extreme is going
-    on ¯\\_(ツ)_/¯.
+    same head branch name in a single repository, then something really extreme
+    is going on ¯\\_(ツ)_/¯.
     """
 
     _query = """
-    query PrsForBranch($repository_id: ID!, $headRefName: String!, $since: DateTime) {
+    query PrsForBranch($repository_id: ID!, $headRefName: String!) {
         node(id: $repository_id) {
             ... on Repository {
                 pullRequests(
@@ -118,44 +174,101 @@ class PrsForBranchQuery(GQLQuery[_PrsForBranchVariables, list[_SparsePullRequest
                         id
                         headRefOid
                         headRepository { id }
-                        timelineItems(
-                            since: $since
-                            itemTypes: [HEAD_REF_FORCE_PUSHED_EVENT]
-                            first: 1
-                        ) {
-                            nodes {
-                                ... on HeadRefForcePushedEvent {
-                                    beforeCommit { oid }
-                                }
-                            }
-                        }
-                        commits(last: 100) {
-                            nodes { commit { oid } }
+                    }
+                }
+            }
+        }
+    }
+    """
+
+
+class _PullRequestHistory(TypedDict):
+    id: str
+    timelineItems: _Connection[_SparseHeadRefForcePushedEvent]
+    commits: _Connection[_SparsePullRequestCommit]
+
+
+class _PullRequestHistoryVariables(TypedDict):
+    ids: list[str]
+    since: datetime.datetime | None
+
+
+class PullRequestHistoryQuery(
+    GQLQuery[_PullRequestHistoryVariables, list[_PullRequestHistory]]
+):
+    """Fetch the recent head history for specific PRs.
+
+    Per PR we include the first force-push event added after the source
+    workflow was created, and the last 100 commits in the PR branch, in the
+    order of the given ids. We can then look for a head reference match
+    against a known commit sha, or against the head sha before a force push.
+    """
+
+    _query = """
+    query PullRequestHistory($ids: [ID!]!, $since: DateTime) {
+        nodes(ids: $ids) {
+            ... on PullRequest {
+                id
+                timelineItems(
+                    since: $since
+                    itemTypes: [HEAD_REF_FORCE_PUSHED_EVENT]
+                    first: 1
+                ) {
+                    nodes {
+                        ... on HeadRefForcePushedEvent {
+                            beforeCommit { oid }
                         }
                     }
                 }
+                commits(last: 100) {
+                    nodes { commit { oid } }
+                }
             }
         }
     }
     """
 
 
-class _SparseIssueComment(TypedDict):
+class SparseIssueComment(TypedDict):
     id: str
     isMinimized: bool
     viewerDidAuthor: bool
+
+
+class IssueCommentBody(TypedDict):
+    id: str
     body: str
 
 
-class _CommentsForPrVariables(TypedDict):
+class _PageInfo(TypedDict):
+    # forward pages have an end cursor, backward pages a start cursor
+    endCursor: NotRequired[str | None]
+    hasNextPage: NotRequired[bool]
+    startCursor: NotRequired[str | None]
+    hasPreviousPage: NotRequired[bool]
+
+
+class CommentsPage(TypedDict):
+    nodes: list[SparseIssueComment]
+    pageInfo: _PageInfo
+
+
+class CommentsForPrVariables(TypedDict):
     pr_id: str
     """The node id of the PR to fetch comments for"""
+    cursor: NotRequired[str | None]
+    """Continue from this cursor, e.g. from a page fetched separately"""
 
 
 class CommentsForPrQuery(
-    GQLPagedQuery[_CommentsForPrVariables, list[_SparseIssueComment]]
+    GQLPagedQuery[CommentsForPrVariables, list[SparseIssueComment]]
 ):
-    """Fetch comments for a given PR."""
+    """Fetch comments for a given PR.
+
+    Comment bodies can be large (think CI bots posting full reports), so only
+    the fields needed to pick out candidate comments are included; fetch the
+    bodies of just those candidates with `CommentBodiesQuery`.
+    """
 
     _query = """
     query CommentsForPR($pr_id: ID!, $cursor: String) {
@@ -166,7 +279,6 @@ class CommentsForPrQuery(
                         id
                         isMinimized
                         viewerDidAuthor
-                        body
                     }
                     pageInfo {
                         endCursor
@@ -179,6 +291,60 @@ class CommentsForPrQuery(
     """
 
 
+class CommentsForPrNewestFirstQuery(
+    GQLPagedQuery[CommentsForPrVariables, list[SparseIssueComment]]
+):
+    """Fetch comments for a given PR, paging backwards from the newest comment
+
+    Each page still lists its comments oldest first.
+    """
+
+    _query = """
+    query CommentsForPRNewestFirst($pr_id: ID!, $cursor: String) {
+        node(id: $pr_id) {
+            ... on PullRequest {
+                comments(last: 100, before: $cursor) {
+                    nodes {
+                        id
+                        isMinimized
+                        viewerDidAuthor
+                    }
+                    pageInfo {
+                        startCursor
+                        hasPreviousPage
+                    }
+                }
+            }
+        }
+    }
+    """
+
+
+class _CommentBodiesVariables(TypedDict):
+    ids: list[str]
+    """The node ids of the comments to fetch the bodies for"""
+
+
+class CommentBodiesQuery(
+    GQLQuery[_CommentBodiesVariables, list[IssueCommentBody | None]]
+):
+    """Fetch the bodies of specific comments, in the order of the given ids
+
+    Comments deleted since they were listed are returned as null.
+    """
+
+    _query = """
+    query CommentBodies($ids: [ID!]!) {
+        nodes(ids: $ids) {
+            ... on IssueComment {
+                id
+                body
+            }
+        }
+    }
+    """
+
+
 class _PullRequestIdVariables(TypedDict):
     repository_id: str
     number: int
@@ -198,6 +364,65 @@ class PullRequestIdQuery(GQLQuery[_PullRequestIdVariables, str]):
     """
 
 
+class CommentsPageForPrNumberQuery(GQLQuery[_PullRequestIdVariables, CommentsPage]):
+    """Fetch the first page of comments for a PR number in a given repository id
+
+    Unlike `CommentsForPrQuery` this doesn't need the PR node id, so it can be
+    batched with the `PullRequestIdQuery` that resolves it.
+    """
+
+    _query = """
+    query CommentsPageForPrNumber($repository_id: ID!, $number: Int!) {
+        node(id: $repository_id) {
+            ... on Repository {
+                pullRequest(number: $number) {
+                    comments(first: 100) {
+                        nodes {
+                            id
+                            isMinimized
+                            viewerDidAuthor
+                        }
+                        pageInfo {
+                            endCursor
+                            hasNextPage
+                        }
+                    }
+                }
+            }
+        }
+    }
+    """
+
+
+class LastCommentsPageForPrNumberQuery(GQLQuery[_PullRequestIdVariables, CommentsPage]):
+    """Fetch the last page of comments for a PR number in a given repository id
+
+    The newest-first counterpart of `CommentsPageForPrNumberQuery`.
+    """
+
+    _query = """
+    query LastCommentsPageForPrNumber($repository_id: ID!, $number: Int!) {
+        node(id: $repository_id) {
+            ... on Repository {
+                pullRequest(number: $number) {
+                    comments(last: 100) {
+                        nodes {
+                            id
+                            isMinimized
+                            viewerDidAuthor
+                        }
+                        pageInfo {
+                            startCursor
+                            hasPreviousPage
+                        }
+                    }
+                }
+            }
+        }
+    }
+    """
+
+
 class _UpdateCommentVariables(TypedDict):
     id: str
     body: str
@@ -0,0 +1,272 @@
+# Rendering figures for the HTML page, and to static images
+import base64
+import json
+import string
+import sys
+from array import array
+from collections.abc import Sequence
+from enum import StrEnum
+from types import TracebackType
+from typing import Any, Literal, Self, cast
+
+import kaleido  # pyright: ignore[reportMissingTypeStubs]
+import plotly.graph_objects as go  # pyright: ignore[reportMissingTypeStubs]
+import plotly.io as pio  # pyright: ignore[reportMissingTypeStubs]
+
+type ImageFormat = Literal["svg", "png"]
+
+
+class PlotlyJS(StrEnum):
+    """Where the HTML page loads plotly.js from"""
+
+    cdn = "cdn"  # a script tag referencing the plotly CDN
+    inline = "inline"  # embedded in the page, see INLINE_PLOTLYJS
+
+
+# Script tag for an inlined plotly.js bundle
+INLINE_PLOTLYJS = '<script type="text/javascript">{}</script>'
+
+
+class FigureEncoding(StrEnum):
+    """How the figure data is encoded in the HTML page"""
+
+    json = "json"  # plain JSON lists, as produced by plotly
+    minified = "minified"  # plain JSON, with a trimmed template, see minify_figure
+    compact = "compact"  # numeric arrays as base64 typed arrays, see compact_figure
+
+
+# Treemap trace attributes holding numeric data arrays
+TYPED_ARRAY_ATTRIBUTES = (("values",), ("customdata",), ("marker", "colors"))
+# Typed array dtypes for integers, narrowest first: array typecode and range
+INTEGER_DTYPES = (
+    ("i1", "b", -(1 << 7), 1 << 7),
+    ("u1", "B", 0, 1 << 8),
+    ("i2", "h", -(1 << 15), 1 << 15),
+    ("u2", "H", 0, 1 << 16),
+    ("i4", "i", -(1 << 31), 1 << 31),
+    ("u4", "I", 0, 1 << 32),
+)
+SHORT_ID_DIGITS = string.digits + string.ascii_lowercase
+
+
+def _json_size(value: Any) -> int:
+    return len(json.dumps(value, separators=(",", ":")))
+
+
+def _numbers_array(values: list[float]) -> tuple[str, array[Any]] | None:
+    """The narrowest typed array dtype and array that hold values exactly"""
+    if all(isinstance(v, int) for v in values):
+        low, high = min(values), max(values)
+        for dtype, typecode, lower, upper in INTEGER_DTYPES:
+            if lower <= low and high < upper:
+                return dtype, array(typecode, values)
+        return None
+    single = array("f", values)
+    if single.tolist() == values:
+        return "f4", single
+    return "f8", array("d", values)
+
+
+def _typed_array(values: Sequence[Any]) -> tuple[dict[str, str], int] | None:
+    """Encode numbers, or rows of numbers, as a plotly.js typed array spec
+
+    Returns the spec and the number of bytes it saves over the JSON list, or
+    None if the values can't be encoded, or if the typed array would be no
+    smaller than the JSON list (e.g. a few digits per number).
+    """
+    shape = None
+    flat: list[Any] = list(values)
+    if flat and all(isinstance(v, list | tuple) for v in flat):
+        width = len(flat[0])
+        if any(len(row) != width for row in flat):
+            return None
+        shape = f"{len(flat)},{width}"
+        flat = [v for row in flat for v in row]
+    if not flat or not all(
+        isinstance(v, int | float) and not isinstance(v, bool) for v in flat
+    ):
+        return None
+    if (encoded := _numbers_array(flat)) is None:
+        return None
+    dtype, data = encoded
+    if sys.byteorder == "big":
+        data.byteswap()
+    spec = {"dtype": dtype, "bdata": base64.b64encode(data.tobytes()).decode()}
+    if shape is not None:
+        spec["shape"] = shape
+    saved = _json_size(values) - _json_size(spec)
+    return (spec, saved) if saved > 0 else None
+
+
+def _short_id(index: int) -> str:
+    digits = ""
+    while True:
+        index, digit = divmod(index, len(SHORT_ID_DIGITS))
+        digits = SHORT_ID_DIGITS[digit] + digits
+        if not index:
+            return digits
+
+
+def _short_ids(trace: dict[str, Any]) -> int:
+    """Replace the treemap ids, and the parents referencing them, by short ids
+
+    Without ids, the labels identify the tiles, so every parent repeats the
+    full (dotted module) name of another tile. Numbering the tiles instead
+    leaves the labels as the only copy of each name. Traces with duplicate
+    ids or parents that are not in the ids are left alone. Returns the number
+    of bytes saved.
+    """
+    ids: list[Any] = trace.get("ids") or trace.get("labels") or []
+    parents: list[Any] = trace.get("parents") or []
+    short = {id: _short_id(i) for i, id in enumerate(ids)}
+    if len(short) != len(ids) or not all(p in short for p in parents if p):
+        return 0
+    new_ids = list(short.values())
+    new_parents = [short[p] if p else "" for p in parents]
+    old_size = _json_size(parents)
+    new_size = _json_size(new_parents) + _json_size(new_ids)
+    if "ids" in trace:
+        old_size += _json_size(trace["ids"])
+    else:  # a new member
+        new_size += len('"ids":,')
+    saved = old_size - new_size
+    if saved <= 0:
+        return 0
+    trace["ids"], trace["parents"] = new_ids, new_parents
+    return saved
+
+
+def _minify(spec: dict[str, Any]) -> int:
+    """Drop template defaults for unused trace types, returning the bytes saved"""
+    traces: list[dict[str, Any]] = spec.get("data") or []
+    layout: dict[str, Any] = spec.get("layout") or {}
+    template: dict[str, Any] = layout.get("template") or {}
+    if not (trace_defaults := cast(dict[str, Any], template.get("data") or {})):
+        return 0
+    used = {trace.get("type", "scatter") for trace in traces}
+    template["data"] = {
+        type: defaults for type, defaults in trace_defaults.items() if type in used
+    }
+    return _json_size(trace_defaults) - _json_size(template["data"])
+
+
+def _compact(spec: dict[str, Any]) -> int:
+    """Encode the data arrays compactly, returning the bytes saved"""
+    saved = 0
+    traces: list[dict[str, Any]] = spec.get("data") or []
+    for trace in traces:
+        for *path, name in TYPED_ARRAY_ATTRIBUTES:
+            container = trace
+            for key in path:
+                container = cast(dict[str, Any], container.get(key) or {})
+            values: Sequence[Any] | None = container.get(name)
+            if values is not None and (typed := _typed_array(values)) is not None:
+                container[name], array_saved = typed
+                saved += array_saved
+        if trace.get("type") == "treemap":
+            saved += _short_ids(trace)
+    return saved
+
+
+def encode_figure(
+    figure: go.Figure, encoding: FigureEncoding
+) -> tuple[dict[str, Any], int]:
+    """The figure as a dict in the given encoding, and the bytes saved
+
+    The saving is measured against the plain JSON encoding of the figure, and
+    is approximate, as plotly escapes some characters when embedding the JSON
+    in the page. Pass the figure dict to `plotly.io.to_html()` with
+    `validate=False`.
+    """
+    spec = cast(dict[str, Any], figure.to_dict())  # pyright: ignore[reportUnknownMemberType]
+    saved = 0
+    if encoding is not FigureEncoding.json:
+        saved += _minify(spec)
+    if encoding is FigureEncoding.compact:
+        saved += _compact(spec)
+    return spec, saved
+
+
+def minify_figure(figure: go.Figure) -> dict[str, Any]:
+    """The figure as a dict, without template defaults for unused trace types
+
+    plotly embeds its whole theme template in every page, including the
+    default styling for each of the trace types it supports. Only the styling
+    for trace types in the figure is kept.
+    """
+    return encode_figure(figure, FigureEncoding.minified)[0]
+
+
+def compact_figure(figure: go.Figure) -> dict[str, Any]:
+    """The figure as a dict, with its data arrays encoded compactly
+
+    plotly.js (2.28 and up) decodes base64-encoded typed arrays, which are
+    smaller and faster to parse than JSON lists of longer numbers; numeric
+    arrays are encoded as such when that is smaller. Tree parents reference
+    short tile ids instead of repeating the tile names. The figure is also
+    minified, see `minify_figure`.
+    """
+    return encode_figure(figure, FigureEncoding.compact)[0]
+
+
+class PreviewRenderer(StrEnum):
+    """How the preview image is rendered"""
+
+    browser = "browser"  # plotly.js in a headless browser, via kaleido
+    native = "native"  # directly in Python, see _svg.render_svg
+
+
+class ImageRenderer:
+    """Render plotly figures to static images
+
+    `figure.to_image()` launches a new headless browser for every image. The
+    renderer instead launches the browser once (the Chromium headless shell at
+    `BROWSER_PATH`, or whatever browser kaleido can find) when the context is
+    entered, keeping it running to serve any number of render requests until
+    the context exits. Up to `tabs` images are rendered concurrently.
+
+    """
+
+    _kaleido: kaleido.Kaleido | None = None
+
+    def __init__(self, tabs: int = 1) -> None:
+        self._tabs = tabs
+
+    async def __aenter__(self) -> Self:
+        browser = kaleido.Kaleido(n=self._tabs)
+        await browser.open()
+        self._kaleido = browser
+        return self
+
+    async def __aexit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc_value: BaseException | None,
+        traceback: TracebackType | None,
+    ) -> None:
+        browser, self._kaleido = self._kaleido, None
+        assert browser is not None
+        await browser.close()
+
+    async def to_image(
+        self, figure: go.Figure, format: ImageFormat = "svg", scale: float = 1
+    ) -> bytes:
+        assert self._kaleido is not None, "Renderer used outside of its context"
+        spec = cast(dict[str, Any], figure.to_dict())  # pyright: ignore[reportUnknownMemberType]
+        # the figure size, resolved the same way figure.to_image() does
+        layout = spec.get("layout", {})
+        template_layout = layout.get("template", {}).get("layout", {})
+        width = (
+            layout.get("width")
+            or template_layout.get("width")
+            or pio.defaults.default_width
+        )
+        height = (
+            layout.get("height")
+            or template_layout.get("height")
+            or pio.defaults.default_height
+        )
+        return await self._kaleido.calc_fig(
+            spec,
+            opts={"format": format, "width": width, "height": height, "scale": scale},
+        )
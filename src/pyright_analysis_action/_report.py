@@ -0,0 +1,265 @@
+# Incremental loading of pyright verifytypes reports
+import codecs
+import json
+import mmap
+import os
+import re
+from collections.abc import Iterator
+from pathlib import Path
+from typing import Any, NamedTuple
+
+import plotly.graph_objects as go  # pyright: ignore[reportMissingTypeStubs]
+from pyright_analysis import schema, treemap
+from pyright_analysis.schema import SymbolName
+from pyright_analysis.treemap import ModuleInfo
+
+CHUNK_SIZE = 1 << 20
+NON_WHITESPACE = re.compile(r"[^ \t\n\r]")
+# a decoded value followed by nothing but these could be a truncated number
+NUMBER_TAIL = re.compile(r"[0-9.eE+-]*")
+
+
+class _JSONStream:
+    """Decode a UTF-8 encoded JSON document one value at a time
+
+    Objects and arrays can be walked member by member, so only a single member
+    value needs to be held in memory at a time. The document is decoded to text
+    a chunk at a time, and values are decoded with the standard library JSON
+    decoder.
+
+    """
+
+    def __init__(self, data: memoryview) -> None:
+        self._data = data
+        self._offset = 0
+        self._utf8 = codecs.getincrementaldecoder("utf-8")()
+        self._decoder = json.JSONDecoder()
+        self._buffer = ""
+        self._pos = 0
+
+    def _fill(self) -> bool:
+        """Decode more data into the buffer; returns False at the end of the data"""
+        if self._offset >= len(self._data):
+            return False
+        # decode at least as much as is still buffered, so re-parsing a large
+        # value that spans many chunks stays linear overall
+        size = max(CHUNK_SIZE, len(self._buffer) - self._pos)
+        end = min(self._offset + size, len(self._data))
+        chunk = self._utf8.decode(
+            self._data[self._offset : end], end == len(self._data)
+        )
+        self._offset = end
+        self._buffer, self._pos = self._buffer[self._pos :] + chunk, 0
+        return True
+
+    def _next_char(self) -> str:
+        """Consume and return the next non-whitespace character ('' at the end)"""
+        while True:
+            if match := NON_WHITESPACE.search(self._buffer, self._pos):
+                self._pos = match.end()
+                return match[0]
+            self._pos = len(self._buffer)
+            if not self._fill():
+                return ""
+
+    def _expect(self, *chars: str) -> str:
+        if (char := self._next_char()) not in chars:
+            raise json.JSONDecodeError(
+                f"Expecting {' or '.join(map(repr, chars))}",
+                self._buffer,
+                max(self._pos - 1, 0),
+            )
+        return char
+
+    def _peek(self) -> str:
+        if char := self._next_char():
+            self._pos -= 1
+        return char
+
+    def value(self) -> Any:
+        """Decode the next complete JSON value"""
+        self._peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buffer, self._pos)
+            except json.JSONDecodeError:
+                if self._fill():
+                    continue
+                raise
+            # a number at the end of the buffer may continue in the next read
+            if not NUMBER_TAIL.fullmatch(self._buffer, end) or not self._fill():
+                self._pos = end
+                return value
+
+    def end(self) -> None:
+        """Verify that there is no more data after the decoded document"""
+        if self._peek():
+            raise json.JSONDecodeError("Extra data", self._buffer, self._pos)
+
+    def object_keys(self) -> Iterator[str]:
+        """Iterate over the keys of an object
+
+        The caller must consume each member value before advancing.
+        """
+        self._expect("{")
+        if self._peek() == "}":
+            self._pos += 1
+            return
+        while True:
+            key = self.value()
+            if not isinstance(key, str):
+                raise json.JSONDecodeError(
+                    "Expecting property name", self._buffer, self._pos
+                )
+            self._expect(":")
+            yield key
+            if self._expect(",", "}") == "}":
+                return
+
+    def array_items(self) -> Iterator[None]:
+        """Iterate over the items of an array
+
+        The caller must consume each item before advancing.
+        """
+        self._expect("[")
+        if self._peek() == "]":
+            self._pos += 1
+            return
+        while True:
+            yield
+            if self._expect(",", "]") == "]":
+                return
+
+
+class _ModuleTallies:
+    """Exported symbol counts per module, tallied while the symbols stream past
+
+    Each exported symbol is counted straight into a mutable
+    `[exported, known, ambiguous, unknown]` tally for its module, so memory use is proportional to the number of modules, not
+    the number of symbols. pyright lists the modules before the symbols; for a
+    report that lists them the other way around, symbols are tallied by name
+    until the module list has been seen, and those tallies are moved into
+    their modules when collating.
+
+    """
+
+    def __init__(self) -> None:
+        self.modules: set[str] = set()
+        self._tallies: dict[str, list[int]] = {}
+
+    def _module_for(self, name: str) -> str:
+        while name and name not in self.modules:
+            name = name.rpartition(".")[0]
+        return name
+
+    def add(self, symbol: dict[str, Any]) -> None:
+        if not symbol["isExported"]:
+            return
+        name = symbol["name"]
+        if self.modules:
+            name = self._module_for(name)
+        known, ambiguous = symbol["isTypeKnown"], symbol["isTypeAmbiguous"]
+        if (tally := self._tallies.get(name)) is None:
+            tally = self._tallies[name] = [0, 0, 0, 0]
+        tally[0] += 1
+        tally[1] += known
+        tally[2] += ambiguous
+        tally[3] += not (known or ambiguous)
+
+    def collate(self) -> dict[SymbolName, ModuleInfo]:
+        """Per-module symbol counts, as collated by pyright_analysis"""
+        modules = {SymbolName(name) for name in self.modules}
+        totals = {module: [0, 0, 0, 0] for module in modules}
+        for name, tally in self._tallies.items():
+            if module := self._module_for(name):
+                total = totals[SymbolName(module)]
+                for i, count in enumerate(tally):
+                    total[i] += count
+        per_module = {
+            module: ModuleInfo(module.parent, *total)
+            for module, total in totals.items()
+        }
+
+        # update parent module totals from their descendants
+        for module in sorted(modules, reverse=True)[:-1]:
+            per_module[module.parent] += per_module[module]
+        return per_module
+
+
+class ReportSummary(NamedTuple):
+    """A pyright report reduced to what is needed to build the treemap
+
+    The `type_completeness.symbols` list of `results` is left empty; the
+    symbols are summarised in the per-module counts in `modules` instead.
+    """
+
+    results: schema.PyrightJsonResults
+    modules: dict[SymbolName, ModuleInfo]
+
+    @property
+    def package_name(self) -> str:
+        return self.results.type_completeness.package_name
+
+
+def load_report(path: Path) -> ReportSummary:
+    """Load a verifytypes JSON report, streaming the symbols list
+
+    The report file is memory-mapped and decoded a chunk at a time, and only
+    the per-module symbol counts are kept, so memory use is proportional to the
+    number of modules rather than to the size of the report.
+    """
+    with path.open("rb") as file:
+        if not os.fstat(file.fileno()).st_size:  # empty files can't be mapped
+            return _summarise(memoryview(b""))
+        with (
+            mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data,
+            memoryview(data) as view,
+        ):
+            data.madvise(mmap.MADV_SEQUENTIAL)
+            return _summarise(view)
+
+
+def _summarise(document: memoryview) -> ReportSummary:
+    stream = _JSONStream(document)
+    tallies = _ModuleTallies()
+    data: dict[str, Any] = {}
+    for key in stream.object_keys():
+        if key != "typeCompleteness":
+            data[key] = stream.value()
+            continue
+        type_completeness: dict[str, Any] = {}
+        for tc_key in stream.object_keys():
+            match tc_key:
+                case "symbols":
+                    for _ in stream.array_items():
+                        tallies.add(stream.value())
+                    type_completeness[tc_key] = []
+                case "modules":
+                    type_completeness[tc_key] = modules = stream.value()
+                    tallies.modules = {module["name"] for module in modules}
+                case _:
+                    type_completeness[tc_key] = stream.value()
+        data[key] = type_completeness
+    stream.end()
+
+    results = schema.PyrightJsonResults.model_validate(data)
+    return ReportSummary(results, tallies.collate())
+
+
+def to_treemap(summary: ReportSummary) -> go.Figure:
+    """Build the treemap figure for a report summary
+
+    The figure is produced by pyright_analysis from the symbol-less report, and
+    the per-module counts are then filled in.
+    """
+    figure = treemap.to_treemap(summary.results.type_completeness)
+    info = [summary.modules[name] for name in sorted(summary.modules)]
+    figure.update_traces(  # pyright: ignore[reportUnknownMemberType]
+        values=[i.exported for i in info],
+        customdata=[
+            (i.completeness_score, i.exported, i.known, i.ambiguous, i.unknown)
+            for i in info
+        ],
+        marker_colors=[i.completeness_score for i in info],
+    )
+    return figure
@@ -1,8 +1,11 @@
+import asyncio
 from typing import Annotated
 
 import typer
 from pyright_analysis import schema, treemap
 
+from ._render import ImageRenderer
+
 
 def smoketest(value: bool) -> None:
     if not value:
@@ -28,7 +31,12 @@ def smoketest(value: bool) -> None:
         symbols=[],
     )
     figure = treemap.to_treemap(test_report)
-    figure.to_image("svg")  # pyright: ignore[reportUnknownMemberType]
+
+    async def render() -> None:
+        async with ImageRenderer() as renderer:
+            await renderer.to_image(figure, "svg")
+
+    asyncio.run(render())
 
     typer.secho("Test passed", fg="green", bold=True, color=True)
     raise typer.Exit(0)
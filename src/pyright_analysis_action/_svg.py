@@ -0,0 +1,264 @@
+# Native SVG rendering of treemap figures, without a browser
+import re
+from collections import defaultdict
+from collections.abc import Sequence
+from html import escape, unescape
+from typing import Any, NamedTuple, cast
+
+import plotly.colors  # pyright: ignore[reportMissingTypeStubs]
+import plotly.graph_objects as go  # pyright: ignore[reportMissingTypeStubs]
+
+# plotly defaults for figure size, margins, tile padding and fonts
+DEFAULT_WIDTH, DEFAULT_HEIGHT = 700, 500
+DEFAULT_MARGIN: dict[str, float] = {"l": 80, "r": 80, "t": 100, "b": 80}
+DEFAULT_FONT = '"Open Sans", verdana, arial, sans-serif'
+DEFAULT_COLOR = "#636efa"
+TILE_PAD = 3
+FONT_SIZE = 12
+# approximate width of an average glyph, relative to the font size
+GLYPH_WIDTH = 0.6
+HEADER = FONT_SIZE + 2 * TILE_PAD
+TITLE_FONT_SIZE = FONT_SIZE * 1.5
+# plotly rich text markup (<b>, <a href=...>, <br>, etc.)
+MARKUP = re.compile(r"<[^>]*>")
+TEXT_ANCHOR = {"left": "start", "center": "middle", "right": "end"}
+
+
+class _Rect(NamedTuple):
+    x: float
+    y: float
+    width: float
+    height: float
+
+    def inset(self, left: float, top: float, right: float, bottom: float) -> "_Rect":
+        return _Rect(
+            self.x + left,
+            self.y + top,
+            max(self.width - left - right, 0),
+            max(self.height - top - bottom, 0),
+        )
+
+
+def _worst(largest: float, smallest: float, total: float, side: float) -> float:
+    """The worst aspect ratio of a row of tiles laid out along side"""
+    side2, total2 = side * side, total * total
+    return max(side2 * largest / total2, total2 / (side2 * smallest))
+
+
+def squarify(sizes: Sequence[float], rect: _Rect) -> list[_Rect]:
+    """Lay out tiles with the given sizes in rect, squarified
+
+    This is the squarified treemap algorithm by Bruls, Huizing and van Wijk,
+    which is also what plotly uses by default. Sizes must be sorted from
+    largest to smallest and positive; the tiles are returned in the same order.
+    """
+    total = sum(sizes)
+    if total <= 0 or not rect.width or not rect.height:
+        return [_Rect(rect.x, rect.y, 0, 0) for _ in sizes]
+    scale = rect.width * rect.height / total
+    areas = [size * scale for size in sizes]
+    tiles: list[_Rect] = []
+    x, y, width, height = rect
+    start = 0
+    while start < len(areas):
+        side = min(width, height)
+        if side <= 0:
+            break
+        end, row_total = start + 1, areas[start]
+        worst = _worst(areas[start], areas[start], row_total, side)
+        while end < len(areas):
+            candidate = _worst(areas[start], areas[end], row_total + areas[end], side)
+            if candidate > worst:
+                break
+            end, row_total, worst = end + 1, row_total + areas[end], candidate
+        thickness = row_total / side
+        offset = 0.0
+        for area in areas[start:end]:
+            length = area / thickness
+            if width >= height:  # a column along the left edge
+                tiles.append(_Rect(x, y + offset, thickness, length))
+            else:  # a row along the top edge
+                tiles.append(_Rect(x + offset, y, length, thickness))
+            offset += length
+        if width >= height:
+            x, width = x + thickness, max(width - thickness, 0)
+        else:
+            y, height = y + thickness, max(height - thickness, 0)
+        start = end
+    tiles += [_Rect(x, y, 0, 0) for _ in areas[len(tiles) :]]
+    return tiles
+
+
+class _Colors:
+    """Map treemap marker colors to SVG fill and text colors
+
+    The colorscale and color range are taken from the marker, or from the
+    layout color axis the marker refers to.
+    """
+
+    def __init__(self, marker: dict[str, Any], layout: dict[str, Any]) -> None:
+        self._colors: Sequence[Any] = marker.get("colors") or ()
+        scale: dict[str, Any] = marker
+        if coloraxis := marker.get("coloraxis"):
+            scale = layout.get(coloraxis) or {}
+        numbers = [c for c in self._colors if isinstance(c, int | float)]
+        cmin: float | None = scale.get("cmin")
+        cmax: float | None = scale.get("cmax")
+        self._cmin = min(numbers, default=0) if cmin is None else cmin
+        self._cmax = max(numbers, default=1) if cmax is None else cmax
+        self._colorscale: str | list[Any] = scale.get("colorscale") or "Plasma"
+
+    def __call__(self, index: int) -> tuple[str, str]:
+        color = self._colors[index] if index < len(self._colors) else DEFAULT_COLOR
+        if isinstance(color, int | float):
+            span = (self._cmax - self._cmin) or 1
+            position = min(max((color - self._cmin) / span, 0), 1)
+            sampled = plotly.colors.sample_colorscale(  # pyright: ignore[reportUnknownMemberType, reportUnknownVariableType]
+                self._colorscale, [position], colortype="tuple"
+            )
+            rgb = cast(tuple[float, float, float], sampled[0])
+        else:
+            converted = plotly.colors.convert_colors_to_same_type(  # pyright: ignore[reportUnknownMemberType, reportUnknownVariableType]
+                color, colortype="tuple"
+            )
+            rgb = cast(tuple[float, float, float], converted[0][0])
+        r, g, b = (round(c * 255) for c in rgb)
+        luminance = 0.299 * r + 0.587 * g + 0.114 * b
+        return f"rgb({r},{g},{b})", "#444" if luminance > 140 else "#fff"
+
+
+class _Treemap:
+    def __init__(self, trace: dict[str, Any], layout: dict[str, Any]) -> None:
+        labels: list[str] = [str(label) for label in trace.get("labels") or ()]
+        ids: list[str] = [str(id) for id in trace.get("ids") or labels]
+        parents: list[str] = [str(p or "") for p in trace.get("parents") or ()]
+        self.labels = labels
+        self.colors = _Colors(trace.get("marker") or {}, layout)
+        self.children: defaultdict[int | None, list[int]] = defaultdict(list)
+        index = {id: i for i, id in enumerate(ids)}
+        for i, parent in enumerate(parents):
+            self.children[index.get(parent)].append(i)
+
+        raw_values = trace.get("values")
+        own: list[float] = (
+            [float(v or 0) for v in raw_values]
+            if raw_values is not None
+            else [0.0 if self.children.get(i) else 1.0 for i in range(len(ids))]
+        )
+        total = trace.get("branchvalues") == "total" and raw_values is not None
+        self.values = own[:]
+        if not total:
+            # add descendant values, deepest nodes first
+            for i in reversed(self._depth_first()):
+                self.values[i] = own[i] + sum(
+                    self.values[c] for c in self.children.get(i, ())
+                )
+
+    def _depth_first(self) -> list[int]:
+        order: list[int] = []
+        stack = list(self.children.get(None, ()))
+        while stack:
+            node = stack.pop()
+            order.append(node)
+            stack.extend(self.children.get(node, ()))
+        return order
+
+    def layout(self, nodes: list[int], rect: _Rect) -> list[tuple[int, _Rect]]:
+        nodes = [n for n in nodes if self.values[n] > 0]
+        nodes.sort(key=self.values.__getitem__, reverse=True)
+        tiles = squarify([self.values[n] for n in nodes], rect)
+        return [(n, t) for n, t in zip(nodes, tiles) if t.width and t.height]
+
+    def render(self, rect: _Rect) -> list[str]:
+        elements: list[str] = []
+        pending = self.layout(self.children.get(None, []), rect)
+        while pending:
+            node, tile = pending.pop()
+            fill, text_color = self.colors(node)
+            elements.append(
+                f'<rect x="{tile.x:.1f}" y="{tile.y:.1f}" width="{tile.width:.1f}" '
+                f'height="{tile.height:.1f}" fill="{fill}" stroke="#fff"/>'
+            )
+            top = TILE_PAD
+            if tile.height >= HEADER:
+                elements.append(self._label(node, tile, text_color))
+                top = HEADER
+            if children := self.children.get(node):
+                inner = tile.inset(TILE_PAD, top, TILE_PAD, TILE_PAD)
+                pending.extend(self.layout(children, inner))
+        return elements
+
+    def _label(self, node: int, tile: _Rect, color: str) -> str:
+        label = self.labels[node] if node < len(self.labels) else ""
+        fits = int((tile.width - 2 * TILE_PAD) / (FONT_SIZE * GLYPH_WIDTH))
+        if len(label) > fits:
+            label = label[: fits - 1] + "…" if fits > 1 else ""
+        return (
+            f'<text x="{tile.x + TILE_PAD:.1f}" y="{tile.y + TILE_PAD + FONT_SIZE:.1f}" '
+            f'fill="{color}">{escape(label)}</text>'
+        )
+
+
+def _title(layout: dict[str, Any]) -> tuple[str, dict[str, Any]] | None:
+    """The figure title text and its settings, without rich text markup
+
+    A title placed in an annotation above the plot (as pyright_analysis does,
+    using the layout title for an attribution footnote instead) takes
+    precedence over the layout title.
+    """
+    annotations: list[dict[str, Any]] = layout.get("annotations") or []
+    title: dict[str, Any] = layout.get("title") or {}
+    for annotation in annotations:
+        if annotation.get("text") and annotation.get("y", 0) >= 1:
+            title = annotation
+            break
+    if text := unescape(MARKUP.sub("", title.get("text") or "")).strip():
+        return text, title
+    return None
+
+
+def render_svg(figure: go.Figure, scale: float = 1) -> bytes:
+    """Render a treemap figure to SVG, without a browser
+
+    The tiles are laid out with the same squarified algorithm plotly uses, and
+    colored from the trace marker colors and colorscale. Only the first treemap
+    trace and the figure title are rendered, and labels that don't fit a tile
+    are truncated, which is good enough for a small preview image.
+    """
+    spec = cast(dict[str, Any], figure.to_dict())  # pyright: ignore[reportUnknownMemberType]
+    layout: dict[str, Any] = spec.get("layout", {})
+    width: float = layout.get("width") or DEFAULT_WIDTH
+    height: float = layout.get("height") or DEFAULT_HEIGHT
+    layout_margin: dict[str, float] = layout.get("margin") or {}
+    margin = DEFAULT_MARGIN | layout_margin
+    layout_font: dict[str, Any] = layout.get("font") or {}
+    font: str = layout_font.get("family") or DEFAULT_FONT
+    plot_area = _Rect(0, 0, width, height).inset(
+        margin["l"], margin["t"], margin["r"], margin["b"]
+    )
+
+    elements: list[str] = []
+    if title := _title(layout):
+        text, settings = title
+        title_font: dict[str, Any] = settings.get("font") or {}
+        font_size: float = title_font.get("size") or TITLE_FONT_SIZE
+        x: float = settings.get("x", 0)
+        anchor = TEXT_ANCHOR.get(settings.get("xanchor", "left"), "middle")
+        elements.append(
+            f'<text x="{plot_area.x + x * plot_area.width:.1f}" '
+            f'y="{margin["t"] / 2:.1f}" text-anchor="{anchor}" '
+            f'font-size="{font_size:g}" fill="#444">{escape(text)}</text>'
+        )
+    traces: list[dict[str, Any]] = [
+        t for t in spec.get("data", ()) if t.get("type") == "treemap"
+    ]
+    if traces:
+        elements += _Treemap(traces[0], layout).render(plot_area)
+
+    svg = (
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{width * scale:g}" '
+        f'height="{height * scale:g}" viewBox="0 0 {width:g} {height:g}" '
+        f'font-family="{escape(font)}" font-size="{FONT_SIZE}">'
+        f'<rect width="100%" height="100%" fill="#fff"/>{"".join(elements)}</svg>'
+    )
+    return svg.encode()
@@ -1,20 +1,69 @@
 import asyncio
+import datetime
+import glob
+import hashlib
+import itertools
 import logging
 import os
 import re
-from typing import Annotated
+import tempfile
+from collections.abc import Awaitable
+from contextlib import AsyncExitStack, ExitStack
+from html import escape
+from pathlib import Path
+from typing import Annotated, Any
 
+import plotly.graph_objects as go  # pyright: ignore[reportMissingTypeStubs]
+import plotly.io as pio  # pyright: ignore[reportMissingTypeStubs]
 import typer
 from githubkit import ActionAuthStrategy, GitHub
-from pyright_analysis import schema, treemap
+from humanize import naturalsize
+from plotly.offline import get_plotlyjs  # pyright: ignore[reportMissingTypeStubs]
 
+from ._cache import DEFAULT_MAX_SIZE, RenderCache, RenderedReport
+from ._render import (
+    INLINE_PLOTLYJS,
+    FigureEncoding,
+    ImageRenderer,
+    PlotlyJS,
+    PreviewRenderer,
+    encode_figure,
+)
+from ._report import load_report, to_treemap
 from ._smoketest import SmokeTest
+from ._svg import render_svg
 from ._utils import set_outputs
-from .comment import Commenter, NotCommenting
-from .smokeshow import upload
+from .comment import (
+    Commenter,
+    CommentOrder,
+    NotCommenting,
+    PublishedPage,
+    PublishedSite,
+)
+from .publish import (
+    LocalSite,
+    Minified,
+    Publisher,
+    Site,
+    iter_chunks,
+    page_url,
+    upload,
+)
+from .smokeshow import MAX_CONCURRENT_UPLOADS, SmokeshowKeyPool, SmokeshowSite
 
 DEBUG = bool(os.environ.get("RUNNER_DEBUG"))
 TEMPLATE_SLOT = re.compile(r"\{\{\s*graph\s*\}\}")
+GLOB_PATTERN = re.compile(r"[*?[]")
+# browser tabs used to render previews concurrently in batch mode
+MAX_RENDER_TABS = 4
+DEFAULT_TEMPLATE = """\
+<html>
+<head><meta charset="utf-8" /></head>
+<body>
+    {{ graph }}
+</body>
+</html>
+"""
 
 app = typer.Typer(
     context_settings={"auto_envvar_prefix": "INPUT"},
@@ -29,21 +78,144 @@ SUMMARY_MESSAGE = """\
 View the [interactive graph for `{package_name}`]({html_url}).
 
 [![preview graph]({preview_url})]({html_url})
+{expiration}"""
 
-*Page available until {expiration}.*
+BATCH_SUMMARY_MESSAGE = """\
+## Pyright Type Completeness Visualisation
+
+View the [overview of all {count} packages]({html_url}).
+
+{packages}{expiration}"""
+
+EXPIRATION_NOTE = """
+*{pages} available until {expiration}.*
 """
 
+BATCH_PACKAGE_SUMMARY = """\
+### [`{package_name}`]({html_url})
+
+[![preview graph for {package_name}]({preview_url})]({html_url})
+"""
+
+INDEX_PAGE = """\
+<html>
+<head>
+<meta charset="utf-8" />
+<title>Pyright Type Completeness Visualisation</title>
+</head>
+<body>
+<h1>Pyright Type Completeness Visualisation</h1>
+{packages}
+</body>
+</html>
+"""
+
+INDEX_PACKAGE = """\
+<h2><a href="{html_url}">{package_name}</a></h2>
+<a href="{html_url}"><img src="{preview_url}" alt="preview graph" /></a>
+"""
+
+
+def expand_reports(arguments: list[Path]) -> list[Path]:
+    """Expand glob patterns in the report arguments
+
+    An argument can hold multiple paths, one per line, as the multi-line
+    `report` action input is passed in as a single value.
+    """
+    reports: list[Path] = []
+    patterns = [
+        Path(line)
+        for argument in arguments
+        for line in map(str.strip, str(argument).splitlines())
+        if line
+    ]
+    for pattern in patterns:
+        if GLOB_PATTERN.search(str(pattern)) is None:
+            if not pattern.is_file():
+                raise typer.BadParameter(f"Report {str(pattern)!r} does not exist.")
+            reports.append(pattern)
+        elif matches := sorted(glob.glob(str(pattern), recursive=True)):
+            reports += map(Path, matches)
+        else:
+            raise typer.BadParameter(f"No reports match {str(pattern)!r}.")
+    return reports
+
+
+def batch_prefixes(package_names: list[str]) -> list[str]:
+    """Directory prefixes for the packages in a batch, in the same order
+
+    Each package gets a directory with a unique name that can't be "." or
+    "..", numbered in order when package names clash.
+    """
+    prefixes: list[str] = []
+    for package_name in package_names:
+        base = re.sub(r"[^\w.-]+", "-", package_name).lstrip(".") or "package"
+        prefix = f"{base}/"
+        for i in itertools.count(2):
+            if prefix not in prefixes:
+                break
+            prefix = f"{base}-{i}/"
+        prefixes.append(prefix)
+    return prefixes
+
+
+def summarise(site: PublishedSite) -> str:
+    expiration = ""
+    if site.expiration is not None:
+        expiration = EXPIRATION_NOTE.format(
+            pages="Page" if len(site.pages) == 1 else "Pages",
+            expiration=site.expiration.isoformat(timespec="seconds"),
+        )
+    if len(site.pages) == 1:
+        return SUMMARY_MESSAGE.format(
+            **site.pages[0].model_dump(), expiration=expiration
+        )
+    packages = "\n".join(
+        BATCH_PACKAGE_SUMMARY.format(**page.model_dump()) for page in site.pages
+    )
+    return BATCH_SUMMARY_MESSAGE.format(
+        count=len(site.pages),
+        html_url=site.html_url,
+        packages=packages,
+        expiration=expiration,
+    )
+
 
 @app.command()
 def action(
-    report: Annotated[typer.FileText, typer.Argument(envvar="INPUT_REPORT")],
+    report: Annotated[
+        list[Path], typer.Argument(envvar="INPUT_REPORT", dir_okay=False)
+    ],
     div_id: Annotated[str | None, typer.Option()] = None,
     template: Annotated[str | None, typer.Option()] = None,
     template_file: Annotated[typer.FileText | None, typer.Option()] = None,
     comment_on_pr: Annotated[bool, typer.Option()] = False,
+    comment_search: Annotated[
+        CommentOrder, typer.Option(case_sensitive=False)
+    ] = CommentOrder.oldest_first,
+    deduplicate: Annotated[bool, typer.Option()] = False,
+    preview_renderer: Annotated[
+        PreviewRenderer, typer.Option(case_sensitive=False)
+    ] = PreviewRenderer.browser,
+    plotlyjs: Annotated[PlotlyJS, typer.Option(case_sensitive=False)] = PlotlyJS.cdn,
+    plotlyjs_bundle: Annotated[
+        Path | None, typer.Option(exists=True, dir_okay=False, readable=True)
+    ] = None,
+    figure_encoding: Annotated[
+        FigureEncoding, typer.Option(case_sensitive=False)
+    ] = FigureEncoding.json,
+    publisher: Annotated[
+        Publisher, typer.Option(case_sensitive=False)
+    ] = Publisher.smokeshow,
+    publish_directory: Annotated[Path | None, typer.Option(file_okay=False)] = None,
+    publish_base_url: Annotated[str | None, typer.Option()] = None,
     smokeshow_auth_key: Annotated[
         str | None, typer.Option(envvar="SMOKESHOW_AUTH_KEY")
     ] = None,
+    smokeshow_key_pool: Annotated[Path | None, typer.Option(dir_okay=False)] = None,
+    upload_concurrency: Annotated[int, typer.Option(min=1)] = MAX_CONCURRENT_UPLOADS,
+    render_cache: Annotated[Path | None, typer.Option(file_okay=False)] = None,
+    render_cache_size: Annotated[int, typer.Option(min=0)] = DEFAULT_MAX_SIZE,
     step_summary: Annotated[
         typer.FileTextWrite | None, typer.Option(envvar="GITHUB_STEP_SUMMARY")
     ] = None,
@@ -70,47 +242,335 @@ def action(
             "Can't find a '{{ graph }}' slot in the provided template."
         )
 
-    async def process_graph() -> None:
-        data = report.read()
-        results = schema.PyrightJsonResults.model_validate_json(data)
-        figure = treemap.to_treemap(results.type_completeness)
+    if publisher is Publisher.local and publish_directory is None:
+        raise typer.BadParameter("Publishing locally requires a publish directory.")
+
+    reports = expand_reports(report)
+    batch = len(reports) > 1
 
-        html_page: str = figure.to_html(  # pyright: ignore[reportUnknownMemberType, reportUnknownVariableType]
-            div_id=div_id, full_html=(template is None), include_plotlyjs="cdn"
+    plotlyjs_source: str | None = None
+    plotlyjs_hash: str | None = None
+    if plotlyjs is PlotlyJS.inline:
+        plotlyjs_source = (
+            plotlyjs_bundle.read_text()
+            if plotlyjs_bundle is not None
+            else get_plotlyjs()  # pyright: ignore[reportUnknownVariableType]
         )
-        assert isinstance(html_page, str)
-        if template is not None:
-            html_page = TEMPLATE_SLOT.sub(html_page, template, 1)
+        assert isinstance(plotlyjs_source, str)
+        plotlyjs_hash = hashlib.sha256(plotlyjs_source.encode()).hexdigest()
+
+    def load(path: Path) -> tuple[str, go.Figure]:
+        """Parse a report and build the treemap figure"""
+        summary = load_report(path)
+        return summary.package_name, to_treemap(summary)
 
-        preview = figure.to_image("svg", scale=0.5)  # pyright: ignore[reportUnknownMemberType, reportUnknownVariableType]
-        assert isinstance(preview, bytes)
+    def render_html(figure: go.Figure, path: Path) -> int:
+        """Render the HTML page for a figure to a file
 
-        expiration, html_url, preview_url = await upload(
-            smokeshow_auth_key, html_page, preview
+        The page is written piece by piece, rather than first assembling the
+        template, plotly.js bundle and graph into a single string. Returns the
+        bytes saved by the figure encoding.
+        """
+        # plotly can only inline its own copy of plotly.js, so any other bundle
+        # is added to the graph here, and the default template applied to that.
+        page_template = template
+        if plotlyjs_source is not None and page_template is None:
+            page_template = DEFAULT_TEMPLATE
+        html_args: dict[str, Any] = {
+            "div_id": div_id,
+            "full_html": page_template is None,
+            "include_plotlyjs": "cdn" if plotlyjs_source is None else False,
+        }
+        spec, saved = encode_figure(figure, figure_encoding)
+        html_page: str = pio.to_html(  # pyright: ignore[reportUnknownMemberType, reportUnknownVariableType]
+            spec, validate=False, **html_args
         )
+        assert isinstance(html_page, str)
+        parts = [html_page]
+        if plotlyjs_source is not None:
+            parts.insert(0, INLINE_PLOTLYJS.format(plotlyjs_source))
+        if page_template is not None:
+            slot = TEMPLATE_SLOT.search(page_template)
+            assert slot is not None
+            parts = [page_template[: slot.start()], *parts, page_template[slot.end() :]]
+        with path.open("wb") as file:
+            for part in parts:
+                file.writelines(iter_chunks(part))
+        return saved
 
-        package_name = results.type_completeness.package_name
-        summary = SUMMARY_MESSAGE.format(
-            package_name=package_name,
-            html_url=html_url,
-            preview_url=preview_url,
-            expiration=expiration.isoformat(timespec="seconds"),
+    def content_hash(path: Path) -> str:
+        return RenderCache.key(
+            path,
+            div_id=div_id,
+            template=template,
+            preview_renderer=preview_renderer,
+            plotlyjs=plotlyjs_hash,
+            figure_encoding=figure_encoding,
         )
 
-        comment_url = None
-        if comment_on_pr and event_name and event_file:
-            with GitHub(ActionAuthStrategy(), base_url=api_url) as client:
-                try:
-                    commenter = await Commenter.from_event(
-                        client, event_name, event_file, workflow=workflow, jobid=jobid
+    async def publish(
+        keys: list[str | None], content_hash: str | None
+    ) -> PublishedSite:
+        """Render the reports and upload them to a new site"""
+        # A key taken from the key pool is used up, even if publishing then
+        # fails, so in that case the site is only created once all reports
+        # have been rendered.
+        site: Site
+        defer_site = False
+        if publisher is Publisher.local:
+            assert publish_directory is not None
+            site = LocalSite(publish_directory, publish_base_url)
+        else:
+            key_pool = None
+            if smokeshow_key_pool is not None:
+                key_pool = SmokeshowKeyPool(smokeshow_key_pool)
+            smokeshow_site = SmokeshowSite(
+                smokeshow_auth_key,
+                key_pool,
+                max_concurrent_uploads=upload_concurrency,
+            )
+            defer_site = smokeshow_site.uses_key_pool
+            site = smokeshow_site
+
+        cache = None
+        if render_cache is not None:
+            cache = RenderCache(render_cache, render_cache_size)
+
+        # Creating the site (which may have to mine a key first) and starting
+        # the headless browser don't depend on the reports, so they run while
+        # the reports are parsed. The HTML pages and the preview images are
+        # then rendered in parallel, and each is uploaded as soon as it is
+        # ready. The native preview renderer doesn't need a browser at all,
+        # and a cached render skips straight to the upload. In batch mode,
+        # each report is published in its own directory, with an index page
+        # linking to all of them. Pages are rendered to files, and streamed
+        # from there when uploaded.
+        all_rendered = asyncio.Event()
+        unrendered = len(reports)
+
+        async with AsyncExitStack() as stack, asyncio.TaskGroup() as group:
+
+            async def create_site() -> Site:
+                if defer_site:
+                    await all_rendered.wait()
+                return await stack.enter_async_context(site)
+
+            site_task = group.create_task(create_site(), name="create_site")
+            page_files = Path(stack.enter_context(tempfile.TemporaryDirectory()))
+            page_numbers = itertools.count()
+            renderer_task: asyncio.Task[ImageRenderer] | None = None
+
+            def renderer() -> asyncio.Task[ImageRenderer]:
+                """Start the headless browser on first use"""
+                nonlocal renderer_task
+                if renderer_task is None:
+                    tabs = min(len(reports), MAX_RENDER_TABS)
+                    renderer_task = group.create_task(
+                        stack.enter_async_context(ImageRenderer(tabs)),
+                        name="start_renderer",
+                    )
+                return renderer_task
+
+            async def render(
+                path: Path, key: str | None
+            ) -> tuple[
+                str,
+                Path | Minified | Awaitable[Path | Minified],
+                bytes | Awaitable[bytes],
+            ]:
+                """Render a report, returning its package name and artefacts"""
+                cached = None
+                if cache is not None and key is not None:
+                    cached = await asyncio.to_thread(cache.get, key)
+                if cached is not None:
+                    typer.echo(f"Using the cached render of {path} from {render_cache}")
+                    return cached
+
+                browser = None
+                if preview_renderer is PreviewRenderer.browser:
+                    browser = renderer()
+                load_task = group.create_task(
+                    asyncio.to_thread(load, path), name=f"load {path}"
+                )
+
+                async def html_page() -> Path | Minified:
+                    _, figure = await load_task
+                    html_page = page_files / f"{next(page_numbers)}.html"
+                    saved = await asyncio.to_thread(render_html, figure, html_page)
+                    size = naturalsize(html_page.stat().st_size, True)
+                    typer.echo(f"Rendered the HTML page for {path} ({size})")
+                    return Minified(html_page, saved) if saved else html_page
+
+                async def preview() -> bytes:
+                    _, figure = await load_task
+                    if browser is None:
+                        return await asyncio.to_thread(render_svg, figure, scale=0.5)
+                    return await (await browser).to_image(figure, "svg", scale=0.5)
+
+                html_task = group.create_task(html_page(), name=f"render_html {path}")
+                preview_task = group.create_task(
+                    preview(), name=f"render_preview {path}"
+                )
+
+                async def store(cache: RenderCache, key: str) -> None:
+                    (package_name, _), html, image = await asyncio.gather(
+                        load_task, html_task, preview_task
+                    )
+                    if isinstance(html, Minified):
+                        html = html.data
+                    assert isinstance(html, Path)
+                    rendered = RenderedReport(package_name, html, image)
+                    await asyncio.to_thread(cache.put, key, rendered)
+
+                if cache is not None and key is not None:
+                    group.create_task(store(cache, key), name=f"store_render {path}")
+                package_name, _ = await load_task
+                return package_name, html_task, preview_task
+
+            async def publish_report(
+                package_name: str,
+                html_page: Path | Minified | Awaitable[Path | Minified],
+                preview: bytes | Awaitable[bytes],
+                prefix: str,
+            ) -> tuple[datetime.datetime | None, PublishedPage]:
+                nonlocal unrendered
+                if defer_site:
+                    if not isinstance(html_page, Path | Minified):
+                        html_page = await html_page
+                    if not isinstance(preview, bytes):
+                        preview = await preview
+                    unrendered -= 1
+                    if not unrendered:
+                        all_rendered.set()
+                expiration, html_url, preview_url = await upload(
+                    await site_task, html_page, preview, prefix=prefix
+                )
+                page = PublishedPage(
+                    package_name=package_name,
+                    html_url=str(html_url),
+                    preview_url=str(preview_url),
+                )
+                return expiration, page
+
+            # the package names are known as soon as the reports are parsed,
+            # so the directories are assigned in report order while the
+            # pages and previews are still rendering
+            rendered = await asyncio.gather(
+                *(render(path, key) for path, key in zip(reports, keys))
+            )
+            prefixes = [""] * len(rendered)
+            if batch:
+                prefixes = batch_prefixes([name for name, _, _ in rendered])
+            published = await asyncio.gather(
+                *(
+                    publish_report(*artefacts, prefix)
+                    for artefacts, prefix in zip(rendered, prefixes)
+                )
+            )
+            expiration = published[0][0]
+            pages = [page for _, page in published]
+            html_url = pages[0].html_url
+            if batch:
+                index_page = INDEX_PAGE.format(
+                    packages="".join(
+                        INDEX_PACKAGE.format(
+                            html_url=escape(page.html_url),
+                            preview_url=escape(page.preview_url),
+                            package_name=escape(page.package_name),
+                        )
+                        for page in pages
                     )
-                except NotCommenting as exc:
-                    typer.secho(
-                        f"Skipping posting a PR comment: {exc.reason}", dim=True
+                )
+                index_url = await (await site_task).upload(
+                    "index.html", index_page, "text/html"
+                )
+                html_url = str(page_url(index_url))
+
+        return PublishedSite(
+            content_hash=content_hash,
+            html_url=html_url,
+            expiration=expiration,
+            pages=pages,
+        )
+
+    async def find_commenter(
+        client: GitHub[Any], event_name: str, event_file: typer.FileText
+    ) -> "Commenter | None":
+        try:
+            return await Commenter.from_event(
+                client,
+                event_name,
+                event_file,
+                comment_search,
+                workflow=workflow,
+                jobid=jobid,
+            )
+        except NotCommenting as exc:
+            typer.secho(f"Skipping posting a PR comment: {exc.reason}", dim=True)
+            return None
+
+    async def process_graph() -> None:
+        with ExitStack() as stack:
+            commenter = None
+            if comment_on_pr and event_name and event_file:
+                client = stack.enter_context(
+                    GitHub(ActionAuthStrategy(), base_url=api_url)
+                )
+                commenter = await find_commenter(client, event_name, event_file)
+
+            keys: list[str | None] = [None] * len(reports)
+            if render_cache is not None or deduplicate:
+                keys = [
+                    *await asyncio.gather(
+                        *(asyncio.to_thread(content_hash, path) for path in reports)
                     )
-                else:
-                    comment_url = await commenter.post_or_update_comment(summary)
-                    typer.secho(f"Comment posted or updated at {comment_url}")
+                ]
+            # the site key covers the rendered content and where it was
+            # published to, so a local site is never reused for smokeshow
+            key = None
+            if all(keys):
+                site_inputs = [*keys, publisher, publish_directory, publish_base_url]
+                key = hashlib.sha256(
+                    "\n".join(map(str, site_inputs)).encode()
+                ).hexdigest()
+
+            # Our existing comment is looked up once, both to update it and
+            # for deduplication: a site linked from the comment that was
+            # published for the same content and won't expire soon is reused,
+            # without mining a key, creating a site or uploading. Without
+            # deduplication, the lookup runs while the reports are published.
+            existing_task = None
+            if commenter is not None:
+                existing_task = asyncio.create_task(
+                    commenter.existing_comment(), name="existing_comment"
+                )
+            try:
+                site = None
+                if deduplicate and existing_task is not None and key is not None:
+                    if (existing := await existing_task) is not None:
+                        site = PublishedSite.from_comment(existing[1])
+                    if site is not None and not site.reusable(key):
+                        site = None
+                    if site is not None:
+                        typer.secho(f"Reusing the unchanged page at {site.html_url}")
+                if site is None:
+                    site = await publish(keys, key)
+            except BaseException:
+                if existing_task is not None:
+                    existing_task.cancel()
+                raise
+
+            summary = summarise(site)
+
+            comment_url = None
+            if commenter is not None:
+                assert existing_task is not None
+                existing = await existing_task
+                comment_id = existing[0] if existing else None
+                comment_url = await commenter.post_or_update_comment(
+                    summary, comment_id, site
+                )
+                typer.secho(f"Comment posted or updated at {comment_url}")
 
         if step_summary:  # pragma: no cover
             step_summary.write(summary)
@@ -121,9 +581,9 @@ def action(
         if output:
             set_outputs(
                 output,
-                html_url=html_url,
-                preview_url=preview_url,
-                expiration=expiration.isoformat(),
+                html_url=site.html_url,
+                preview_url="" if batch else site.pages[0].preview_url,
+                expiration=site.expiration.isoformat() if site.expiration else "",
                 comment_url=comment_url,
             )
 
@@ -0,0 +1,6 @@
+import typer
+
+from . import keys
+
+cli = typer.Typer(add_completion=False)
+cli.add_typer(keys.app, name="keys")
@@ -1,18 +1,41 @@
 import datetime
+import re
+import time
+from collections.abc import AsyncIterator, Awaitable, Callable, Sequence
+from enum import StrEnum
+from functools import partial
 from typing import Any, Self
 
 import typer
 from githubkit import GitHub
+from githubkit.exception import GitHubException
 from githubkit.webhooks import parse
+from pydantic import BaseModel, ValidationError
+from pydantic.types import AwareDatetime
 
 from ._graphql import (
     AddCommentMutation,
+    CommentBodiesQuery,
+    CommentsForPrNewestFirstQuery,
     CommentsForPrQuery,
+    CommentsForPrVariables,
+    CommentsPage,
+    CommentsPageForPrNumberQuery,
+    GQLBatch,
+    LastCommentsPageForPrNumberQuery,
     PrsForBranchQuery,
+    PullRequestHistoryQuery,
+    PullRequestIdQuery,
+    SparseIssueComment,
     UpdateCommentMutation,
 )
 from ._utils import pr_id_from_number
 
+SITE_MARKER = "<!-- pyright-analysis-action-site {} -->"
+SITE_MARKER_PATTERN = re.compile(r"<!-- pyright-analysis-action-site (\{.*?\}) -->")
+# how long a published site must remain available to be reused
+REUSE_MARGIN = datetime.timedelta(days=1)
+
 
 class NotCommenting(Exception):
     """Exception raised when no PR could be found to comment on"""
@@ -22,6 +45,64 @@ class NotCommenting(Exception):
         self.reason = reason
 
 
+class PublishedPage(BaseModel):
+    """The graph page and preview image published for a single package"""
+
+    package_name: str
+    html_url: str
+    preview_url: str
+
+
+class PublishedSite(BaseModel):
+    """A published smokeshow site, as recorded in a PR comment
+
+    `content_hash` identifies the reports and render inputs the site was
+    published for (see `RenderCache.key`). `html_url` is the graph page when
+    a single report was published, or the index page for a batch of reports.
+    """
+
+    content_hash: str | None
+    html_url: str
+    expiration: AwareDatetime | None
+    pages: list[PublishedPage]
+
+    @property
+    def marker(self) -> str:
+        return SITE_MARKER.format(self.model_dump_json())
+
+    @classmethod
+    def from_comment(cls, body: str) -> Self | None:
+        if (match := SITE_MARKER_PATTERN.search(body)) is None:
+            return None
+        try:
+            return cls.model_validate_json(match[1])
+        except ValidationError:
+            return None
+
+    def reusable(self, content_hash: str) -> bool:
+        """Is this site for the same content, and still available for a while?
+
+        A site about to expire is not reused, as the comment linking to it
+        would soon point to a missing page.
+        """
+        if self.content_hash != content_hash:
+            return False
+        if self.expiration is None:  # never expires
+            return True
+        return self.expiration > datetime.datetime.now(datetime.UTC) + REUSE_MARGIN
+
+
+class CommentOrder(StrEnum):
+    """The order to search the PR comments in for an existing comment
+
+    Searching newest first finds a comment near the end of a long PR without
+    fetching all the comments before it.
+    """
+
+    oldest_first = "oldest-first"
+    newest_first = "newest-first"
+
+
 class Commenter:
     @classmethod
     async def from_event(
@@ -29,14 +110,30 @@ class Commenter:
         client: GitHub[Any],
         event_name: str,
         event_file: typer.FileText,
+        order: CommentOrder = CommentOrder.oldest_first,
         **context: str | None,
     ) -> Self:
+        comments_page = None
         match event_name:
             case "pull_request" | "pull_request_target":
                 event = parse("pull_request", event_file.read())
-                node_id = await pr_id_from_number(
-                    client, event.repository.node_id, event.number
+                # resolve the PR and fetch its first page of comments together
+                repo_id, number = event.repository.node_id, event.number
+                batch = GQLBatch(client)
+                pr_id = batch.add(
+                    PullRequestIdQuery(client),
+                    {"repository_id": repo_id, "number": number},
+                )
+                page_query = (
+                    LastCommentsPageForPrNumberQuery
+                    if order is CommentOrder.newest_first
+                    else CommentsPageForPrNumberQuery
+                )
+                first_page = batch.add(
+                    page_query(client), {"repository_id": repo_id, "number": number}
                 )
+                await batch.execute()
+                node_id, comments_page = pr_id.result(), first_page.result()
             case "workflow_run":
                 event = parse(event_name, event_file.read())
                 run = event.workflow_run
@@ -44,44 +141,85 @@ class Commenter:
                     raise NotCommenting(
                         "This workflow_run event was not triggered by a pull_request workflow"
                     )
+                # Resolution strategies, from cheapest to most expensive
+                strategies: list[tuple[str, Callable[[], Awaitable[str | None]]]] = []
                 if any(run.pull_requests):
                     number = next(filter(None, run.pull_requests)).number
-                    node_id = await pr_id_from_number(
-                        client, event.repository.node_id, number
+                    strategies.append(
+                        (
+                            "the workflow_run pull requests",
+                            partial(
+                                pr_id_from_number,
+                                client,
+                                event.repository.node_id,
+                                number,
+                            ),
+                        )
                     )
-                elif (head_branch := run.head_branch) is None:
+                if (head_branch := run.head_branch) is not None:
+                    strategies.append(
+                        (
+                            "the pull requests for the head commit",
+                            partial(
+                                pr_from_commit,
+                                client,
+                                event.repository.owner.login,
+                                event.repository.name,
+                                run.head_repository.node_id,
+                                head_branch,
+                                run.head_sha,
+                            ),
+                        )
+                    )
+                    strategies.append(
+                        (
+                            "the pull requests for the head branch",
+                            partial(
+                                pr_from_workflow_run,
+                                client,
+                                run.repository.node_id,
+                                run.head_repository.node_id,
+                                head_branch,
+                                run.head_sha,
+                                run.created_at,
+                            ),
+                        )
+                    )
+                elif not strategies:
                     raise NotCommenting(
                         "No head branch reported for workflow_run parent workflow"
                     )
-                else:
-                    node_id = await pr_from_workflow_run(
-                        client,
-                        run.repository.node_id,
-                        run.head_repository.node_id,
-                        head_branch,
-                        run.head_sha,
-                        run.created_at,
-                    )
-                    if node_id is None:
-                        raise NotCommenting("No PR found for this workflow_run event")
+                node_id = await find_pr(strategies)
+                if node_id is None:
+                    raise NotCommenting("No PR found for this workflow_run event")
 
             case _:
                 raise NotCommenting(
                     "Workflow was not triggered by a pull_request or "
                     f"workflow_run event ({event_name!r})"
                 )
-        return cls(client, node_id, **context)
+        return cls(client, node_id, comments_page, order, **context)
 
     def __init__(
         self,
         client: GitHub[Any],
         pr_id: str,
+        comments_page: CommentsPage | None = None,
+        order: CommentOrder = CommentOrder.oldest_first,
         **context: str | None,
     ) -> None:
         self.pr = pr_id
+        self.order = order
         self.comment_context = context
+        # the first page of comments, when fetched while resolving the PR
+        self._comments_page = comments_page
 
-        self._comments_for_pr_query = CommentsForPrQuery(client)
+        self._comments_for_pr_query = (
+            CommentsForPrNewestFirstQuery(client)
+            if order is CommentOrder.newest_first
+            else CommentsForPrQuery(client)
+        )
+        self._comment_bodies_query = CommentBodiesQuery(client)
         self._update_comment = UpdateCommentMutation(client)
         self._add_comment = AddCommentMutation(client)
 
@@ -95,30 +233,72 @@ class Commenter:
         )
         return f"<!-- pyright-analysis-action {context} -->"
 
-    async def existing_comment_id(self) -> str | None:
-        """Find the node id of an existing comment"""
+    async def _comment_pages(self) -> AsyncIterator[list[SparseIssueComment]]:
+        """Pages of comments on this PR, in search order"""
+        newest_first = self.order is CommentOrder.newest_first
+        variables: CommentsForPrVariables = {"pr_id": self.pr}
+        if (first_page := self._comments_page) is not None:
+            nodes, page_info = first_page["nodes"], first_page["pageInfo"]
+            yield nodes[::-1] if newest_first else nodes
+            if newest_first and page_info.get("hasPreviousPage"):
+                variables["cursor"] = page_info.get("startCursor")
+            elif not newest_first and page_info.get("hasNextPage"):
+                variables["cursor"] = page_info.get("endCursor")
+            else:
+                return
+        async for page in self._comments_for_pr_query(variables):
+            yield page[::-1] if newest_first else page
+
+    async def existing_comment(self) -> tuple[str, str] | None:
+        """Find the node id and body of an existing comment
+
+        Comments are listed without their bodies first; only the bodies of
+        comments we authored and that are not minimized are then fetched, to
+        look for the marker. The search stops at the first matching comment,
+        so no further pages are fetched once it is found.
+        """
         marker = self.comment_marker
-        async for page in self._comments_for_pr_query({"pr_id": self.pr}):
+        async for page in self._comment_pages():
+            candidates = [
+                cmt["id"]
+                for cmt in page
+                if cmt["viewerDidAuthor"] and not cmt["isMinimized"]
+            ]
+            if not candidates:
+                continue
+            bodies = await self._comment_bodies_query({"ids": candidates})
             try:
                 return next(
-                    cmt["id"]
-                    for cmt in page
-                    if cmt["viewerDidAuthor"]
-                    and not cmt["isMinimized"]
-                    and marker in cmt["body"]
+                    (cmt["id"], cmt["body"])
+                    for cmt in bodies
+                    if cmt is not None and marker in cmt["body"]
                 )
             except StopIteration:
                 pass
         return None
 
-    async def post_or_update_comment(self, summary: str) -> str:
+    async def existing_comment_id(self) -> str | None:
+        """Find the node id of an existing comment"""
+        existing = await self.existing_comment()
+        return existing[0] if existing else None
+
+    async def post_or_update_comment(
+        self,
+        summary: str,
+        comment_id: str | None,
+        site: PublishedSite | None = None,
+    ) -> str:
         """Post or update a comment on this PR
 
-        If a pre-existing comment is found, this is updated, otherwise a new
-        comment is created. Returns the comment URL.
+        The existing comment with `comment_id` is updated (see
+        `existing_comment_id()`), or a new comment is created if there is
+        none. The site, if given, is recorded in the comment so a later run
+        can reuse it. Returns the comment URL.
         """
         body = f"{summary}\n\n{self.comment_marker}"
-        if comment_id := await self.existing_comment_id():
+        if site is not None and site.content_hash is not None:
+            body = f"{body}\n{site.marker}"
+        if comment_id is not None:
             # update
             return await self._update_comment({"id": comment_id, "body": body})
         else:
@@ -126,6 +306,56 @@ class Commenter:
             return await self._add_comment({"subjectId": self.pr, "body": body})
 
 
+async def find_pr(
+    strategies: Sequence[tuple[str, Callable[[], Awaitable[str | None]]]],
+) -> str | None:
+    """Try each named strategy in turn, until one finds the PR node id"""
+    for name, strategy in strategies:
+        start = time.perf_counter()
+        node_id = await strategy()
+        elapsed = time.perf_counter() - start
+        if node_id is not None:
+            typer.secho(f"Found the PR from {name} in {elapsed:.3f}s", dim=True)
+            return node_id
+        typer.secho(f"No PR found from {name} ({elapsed:.3f}s)", dim=True)
+    return None
+
+
+async def pr_from_commit(
+    client: GitHub[Any],
+    owner: str,
+    repo: str,
+    head_repo_id: str,
+    head_branch: str,
+    head_sha: str,
+) -> str | None:
+    """Find the pull request for a workflow_run from its head commit.
+
+    This is a single, cheap REST API call that usually identifies the PR
+    directly. Only open PRs are listed for commits that have not been merged
+    yet, and these must match the head repository and branch. Returns None
+    when there is no single match, so a more thorough search can take over.
+    """
+    try:
+        response = (
+            await client.rest.repos.async_list_pull_requests_associated_with_commit(
+                owner, repo, head_sha
+            )
+        )
+    except GitHubException:
+        return None
+    matches = [
+        pr
+        for pr in response.parsed_data
+        if pr.head.ref == head_branch
+        and pr.head.repo is not None
+        and pr.head.repo.node_id == head_repo_id
+    ]
+    if len(matches) > 1:
+        matches = [pr for pr in matches if pr.head.sha == head_sha]
+    return matches[0].node_id if len(matches) == 1 else None
+
+
 async def pr_from_workflow_run(
     client: GitHub[Any],
     repo_id: str,
@@ -152,21 +382,25 @@ async def pr_from_workflow_run(
     # Matching a head sha would be perfect, but the head sha can have changed
     # since the workflow started, with new commits or force pushes. Luckily, we
     # have full access to that information here.
+    # This is done in stages, as the commit history is by far the most costly
+    # part to query, and is rarely needed.
     nodes = await PrsForBranchQuery(client)(
-        {
-            "repository_id": repo_id,
-            "headRefName": head_branch,
-            "since": created_at,
-        },
+        {"repository_id": repo_id, "headRefName": head_branch}
     )
     # the head branch name may not be unique; the head repo owner must match too.
     filtered = [pr for pr in nodes if pr["headRepository"]["id"] == head_repo_id]
-    if len(filtered) == 1:  # simple, just a single branch fits
-        return filtered[0]["id"]
+    if len(filtered) <= 1:  # simple, just a single branch fits (or none at all)
+        return filtered[0]["id"] if filtered else None
+    # a PR head that hasn't moved since the workflow started
+    if match := next((pr for pr in filtered if pr["headRefOid"] == head_sha), None):
+        return match["id"]
 
-    # narrow it down by head ref
-    for pr in filtered:
-        refs = {pr["headRefOid"]} | {c["commit"]["oid"] for c in pr["commits"]["nodes"]}
+    # narrow it down by head ref history, for the remaining candidates only
+    histories = await PullRequestHistoryQuery(client)(
+        {"ids": [pr["id"] for pr in filtered], "since": created_at}
+    )
+    for pr in histories:
+        refs = {c["commit"]["oid"] for c in pr["commits"]["nodes"]}
         if timeline := pr["timelineItems"]["nodes"]:
             # the head ref at the time the workflow started before a force push changed it
             refs.add(timeline[0]["beforeCommit"]["oid"])
@@ -174,4 +408,4 @@ async def pr_from_workflow_run(
             return pr["id"]
 
     # if we still can't figure it out, just pick the most recently updated.
-    return filtered[0]["id"] if filtered else None
+    return filtered[0]["id"]
@@ -0,0 +1,31 @@
+from pathlib import Path
+from typing import Annotated
+
+import typer
+
+from .smokeshow import SmokeshowKeyPool, generate_smokeshow_key
+
+app = typer.Typer(
+    help="Manage a pool of pre-mined smokeshow keys.", add_completion=False
+)
+
+
+@app.command()
+def mine(
+    pool: Annotated[Path, typer.Argument(envvar="SMOKESHOW_KEY_POOL", dir_okay=False)],
+    count: Annotated[int, typer.Option(min=1)] = 1,
+    workers: Annotated[int | None, typer.Option(min=1)] = None,
+) -> None:
+    """Generate COUNT smokeshow keys and add them to the POOL file."""
+    key_pool = SmokeshowKeyPool(pool)
+    for _ in range(count):
+        key_pool.add([generate_smokeshow_key(workers)])
+    typer.secho(f"{pool} now holds {len(key_pool):,} keys", fg="green", bold=True)
+
+
+@app.command()
+def count(
+    pool: Annotated[Path, typer.Argument(envvar="SMOKESHOW_KEY_POOL", dir_okay=False)],
+) -> None:
+    """Report how many keys are left in the POOL file."""
+    typer.echo(f"{len(SmokeshowKeyPool(pool)):,}")
@@ -0,0 +1,181 @@
+import asyncio
+import datetime
+import shutil
+import types
+from collections.abc import Awaitable, Iterator
+from enum import StrEnum
+from pathlib import Path
+from typing import NamedTuple, Protocol, Self
+
+import typer
+from humanize import naturalsize
+from yarl import URL
+
+# Text and files at least this large are streamed, in chunks of this size
+CHUNK_SIZE = 1024 * 1024
+
+# Upload contents: bytes, text to send as UTF-8, or a file to stream from disk
+type UploadData = bytes | str | Path
+
+
+class Minified(NamedTuple):
+    """Upload contents that were made smaller, and how many bytes that saved"""
+
+    data: UploadData
+    saved: int
+
+
+class Publisher(StrEnum):
+    """Where the HTML page and preview image are published"""
+
+    smokeshow = "smokeshow"
+    local = "local"
+
+
+class Site(Protocol):
+    """A site that reports are published to, created when entering the context"""
+
+    @property
+    def expiration(self) -> datetime.datetime | None:
+        """When the site expires, or None if it is never removed"""
+        ...
+
+    async def __aenter__(self) -> Self: ...
+
+    async def __aexit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc_value: BaseException | None,
+        traceback: types.TracebackType | None,
+    ) -> bool | None: ...
+
+    async def upload(
+        self, name: str, data: UploadData, content_type: str, saved: int = 0
+    ) -> URL:
+        """Publish a file on the site, returning its URL
+
+        `saved` is the number of bytes minifying the contents saved, to log.
+        """
+        ...
+
+
+def iter_chunks(data: str | Path) -> Iterator[bytes]:
+    """Yield text as UTF-8, or the file contents, in chunks of CHUNK_SIZE"""
+    if isinstance(data, str):
+        for start in range(0, len(data), CHUNK_SIZE):
+            yield data[start : start + CHUNK_SIZE].encode()
+        return
+    with data.open("rb") as file:
+        while chunk := file.read(CHUNK_SIZE):
+            yield chunk
+
+
+def utf8_size(text: str) -> int:
+    """The size of text encoded as UTF-8, without encoding it all in one go"""
+    return len(text) if text.isascii() else sum(map(len, iter_chunks(text)))
+
+
+def page_url(url: URL) -> URL:
+    """The URL for a page, without `index.html` when a web server adds that"""
+    if url.parts[-1] == "index.html" and url.scheme != "file":
+        return url.parent
+    return url
+
+
+class LocalSite:
+    """Publish reports to a local directory instead of a hosted site
+
+    Files are written to `directory`, and linked to with `file://` URLs unless
+    a `base_url` is given that the directory is served from (e.g. by an
+    internal artefact store, or `python -m http.server`). Publishing locally
+    also takes the network out of the picture when benchmarking the action.
+
+    """
+
+    # local sites are not cleaned up, so their pages never expire
+    expiration = None
+
+    def __init__(self, directory: Path, base_url: str | None = None) -> None:
+        self.directory = directory
+        self.base_url = URL(base_url) if base_url is not None else None
+
+    async def __aenter__(self) -> Self:
+        await asyncio.to_thread(self.directory.mkdir, parents=True, exist_ok=True)
+        typer.echo(f"Publishing to {self.directory}")
+        return self
+
+    async def __aexit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc_value: BaseException | None,
+        traceback: types.TracebackType | None,
+    ) -> bool | None:
+        return None
+
+    def _write(self, path: Path, data: UploadData) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        match data:
+            case bytes():
+                path.write_bytes(data)
+            case str():
+                with path.open("wb") as file:
+                    file.writelines(iter_chunks(data))
+            case Path():
+                shutil.copyfile(data, path)
+
+    async def upload(
+        self, name: str, data: UploadData, content_type: str, saved: int = 0
+    ) -> URL:
+        path = self.directory / name
+        if not path.resolve().is_relative_to(self.directory.resolve()):
+            raise ValueError(f"{name!r} is outside of {self.directory}")
+        await asyncio.to_thread(self._write, path, data)
+        size = naturalsize(path.stat().st_size, True)
+        if saved:
+            size = f"{size}, saved {naturalsize(saved, True)}"
+        typer.secho(f"Wrote {name} ({content_type}, {size})", italic=True)
+        if self.base_url is None:
+            return URL(path.resolve().as_uri())
+        return self.base_url / name
+
+
+async def _upload_when_ready(
+    site: Site,
+    name: str,
+    data: UploadData | Minified | Awaitable[UploadData | Minified],
+    content_type: str,
+) -> URL:
+    if not isinstance(data, bytes | str | Path | Minified):
+        data = await data
+    saved = 0
+    if isinstance(data, Minified):
+        data, saved = data
+    return await site.upload(name, data, content_type, saved=saved)
+
+
+async def upload(
+    site: Site,
+    html_page: str | Path | Minified | Awaitable[str | Path | Minified],
+    preview_image: bytes | Awaitable[bytes],
+    prefix: str = "",
+) -> tuple[datetime.datetime | None, URL, URL]:
+    """Upload the HTML page and preview image to the site
+
+    Either can be passed in as an awaitable that is still being rendered; each
+    is uploaded as soon as it is available. Pass a large HTML page as the path
+    of a file, so it is streamed from disk, and wrap a page that was minified
+    in `Minified` to log the bytes saved. The prefix, if given, places both
+    files in a subdirectory of the site (e.g. `"package/"`).
+    """
+    async with asyncio.TaskGroup() as group:
+        html_task = group.create_task(
+            _upload_when_ready(site, f"{prefix}index.html", html_page, "text/html"),
+            name=f"{prefix}html_upload",
+        )
+        image_task = group.create_task(
+            _upload_when_ready(
+                site, f"{prefix}preview.svg", preview_image, "image/svg+xml"
+            ),
+            name=f"{prefix}preview_upload",
+        )
+    return site.expiration, page_url(html_task.result()), image_task.result()
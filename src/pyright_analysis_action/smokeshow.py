@@ -3,11 +3,16 @@ import base64
 import datetime
 import logging
 import os
+import threading
+import time
 import types
-from contextlib import AbstractAsyncContextManager
+from collections.abc import AsyncIterator, Generator, Iterable
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from contextlib import AbstractAsyncContextManager, contextmanager
 from hashlib import sha256
-from itertools import count
-from typing import Annotated, Self
+from multiprocessing import get_context
+from pathlib import Path
+from typing import Annotated, BinaryIO, NamedTuple, Self
 
 import aiohttp
 import typer
@@ -25,10 +30,20 @@ from tenacity import (
 )
 from yarl import URL
 
+from .publish import CHUNK_SIZE, UploadData, iter_chunks, utf8_size
+
 # smokeshow asks for a key where the first 22 bits of the SHA256 hash are 0.
-# This translates to a digest with 2 NULs and a 0, 1, 2 or 3 byte in position 3
-HASH_PREFIXES = tuple(bytes([0, 0, i]) for i in range(4))
+# Read as a big-endian integer, such a digest is smaller than 2 ** (256 - 22).
+KEY_DIFFICULTY = 22
+# Keys are 50 random bytes. Candidates share a random base and differ only in
+# a trailing counter, so a whole batch needs just the one urandom call.
+KEY_SIZE, KEY_COUNTER_SIZE = 50, 8
 REPORT_INTERVAL = 100_000
+# Number of attempts a key search worker makes before reporting back. Small
+# enough that the remaining workers stop within milliseconds of a hit.
+SEARCH_BATCH_SIZE = 10_000
+# Default number of files uploaded to a site at the same time
+MAX_CONCURRENT_UPLOADS = 4
 
 
 USER_AGENT = (
@@ -86,34 +101,302 @@ class SmokeshowUploadResponse(BaseModel):
     content_type: str
     size: int
     total_site_size: int
+    # bytes saved by minifying the contents, set locally
+    saved: int = 0
 
     def __str__(self) -> str:
         size, total = (
             naturalsize(self.size, True),
             naturalsize(self.total_site_size, True),
         )
+        if self.saved:
+            size = f"{size}, saved {naturalsize(self.saved, True)}"
         return f"Uploaded {self.path} ({self.content_type}, {size}, total {total})"
 
 
-def generate_smokeshow_key() -> str:
+class ConnectionSettings(NamedTuple):
+    """Connection pool and timeout settings for the smokeshow client session
+
+    Connections are kept alive between requests, so site creation, the uploads
+    and any retries share a small pool of connections rather than each
+    setting up a new one. Timeouts are in seconds; each request is limited
+    to `total_timeout` (aiohttp's default), with tighter limits on connecting
+    and on waiting for data on top of that.
+
+    """
+
+    limit: int = 8
+    keepalive_timeout: float = 30
+    dns_cache_ttl: int = 300
+    total_timeout: float = 300
+    connect_timeout: float = 10
+    read_timeout: float = 60
+
+    def connector(self) -> aiohttp.TCPConnector:
+        return aiohttp.TCPConnector(
+            limit=self.limit,
+            keepalive_timeout=self.keepalive_timeout,
+            use_dns_cache=True,
+            ttl_dns_cache=self.dns_cache_ttl,
+        )
+
+    def timeout(self) -> aiohttp.ClientTimeout:
+        return aiohttp.ClientTimeout(
+            total=self.total_timeout,
+            sock_connect=self.connect_timeout,
+            sock_read=self.read_timeout,
+        )
+
+
+DEFAULT_CONNECTION = ConnectionSettings()
+
+
+def _timing_trace_config() -> aiohttp.TraceConfig:
+    """Log how long each request spent setting up a connection, and in transfer
+
+    The connection time includes the DNS lookup, and is zero when a pooled
+    connection was reused. Transfer time runs until the response headers
+    arrive.
+
+    """
+    config = aiohttp.TraceConfig()
+
+    async def on_request_start(
+        session: aiohttp.ClientSession,
+        ctx: types.SimpleNamespace,
+        params: aiohttp.TraceRequestStartParams,
+    ) -> None:
+        ctx.start, ctx.connect, ctx.reused = time.perf_counter(), 0.0, False
+
+    async def on_connection_create_start(
+        session: aiohttp.ClientSession,
+        ctx: types.SimpleNamespace,
+        params: aiohttp.TraceConnectionCreateStartParams,
+    ) -> None:
+        ctx.connect_start = time.perf_counter()
+
+    async def on_connection_create_end(
+        session: aiohttp.ClientSession,
+        ctx: types.SimpleNamespace,
+        params: aiohttp.TraceConnectionCreateEndParams,
+    ) -> None:
+        ctx.connect = time.perf_counter() - ctx.connect_start
+
+    async def on_connection_reuseconn(
+        session: aiohttp.ClientSession,
+        ctx: types.SimpleNamespace,
+        params: aiohttp.TraceConnectionReuseconnParams,
+    ) -> None:
+        ctx.reused = True
+
+    async def on_request_end(
+        session: aiohttp.ClientSession,
+        ctx: types.SimpleNamespace,
+        params: aiohttp.TraceRequestEndParams,
+    ) -> None:
+        total = time.perf_counter() - ctx.start
+        _logger.debug(
+            "%s %s: %d in %.3fs (connect %.3fs%s, transfer %.3fs)",
+            params.method,
+            params.url,
+            params.response.status,
+            total,
+            ctx.connect,
+            ", reused" if ctx.reused else "",
+            total - ctx.connect,
+        )
+
+    config.on_request_start.append(on_request_start)
+    config.on_connection_create_start.append(on_connection_create_start)
+    config.on_connection_create_end.append(on_connection_create_end)
+    config.on_connection_reuseconn.append(on_connection_reuseconn)
+    config.on_request_end.append(on_request_end)
+    return config
+
+
+async def _stream_text(text: str) -> AsyncIterator[bytes]:
+    for chunk in iter_chunks(text):
+        yield chunk
+
+
+@contextmanager
+def _request_body(
+    data: UploadData,
+) -> Generator[bytes | AsyncIterator[bytes] | BinaryIO]:
+    """A fresh request body for data, so a retried upload starts from scratch"""
+    if isinstance(data, Path):
+        with data.open("rb") as file:
+            yield file
+    else:
+        yield _stream_text(data) if isinstance(data, str) else data
+
+
+def _search_key(
+    difficulty: int, attempts: int
+) -> tuple[int, bytes | None]:  # pragma: no cover (runs in a worker process)
+    """Try up to `attempts` candidate keys, returning the attempt count and a hit
+
+    The SHA256 state for the shared random base is computed once and copied for
+    each candidate, and each digest is tested with a single integer comparison.
+
+    """
+    base = os.urandom(KEY_SIZE - KEY_COUNTER_SIZE)
+    new_hash, target = sha256(base).copy, 1 << (256 - difficulty)
+    for counter in range(attempts):
+        suffix = counter.to_bytes(KEY_COUNTER_SIZE)
+        candidate = new_hash()
+        candidate.update(suffix)
+        if int.from_bytes(candidate.digest()) < target:
+            return counter + 1, base + suffix
+    return attempts, None
+
+
+class KeySearchStopped(Exception):
+    """Raised when a key search is stopped before a key was found"""
+
+
+def generate_smokeshow_key(
+    workers: int | None = None, stop: threading.Event | None = None
+) -> str:
+    """Find a random key whose SHA256 hash meets the smokeshow requirements
+
+    The search is spread across `workers` processes, defaulting to the number
+    of CPUs available to this process. Each worker searches in batches of
+    `SEARCH_BATCH_SIZE` attempts; as soon as one batch produces a hit no new
+    batches are handed out and any queued batches are cancelled. The same
+    happens when the `stop` event is set, raising `KeySearchStopped`.
+
+    """
     typer.echo(
         "Generating a smokeshow key with valid hash. Hold tight, this might take a minute..."
     )
-    attempt, attempts = count(1).__next__, 0
-    hash = seed = b""
-    while not hash.startswith(HASH_PREFIXES):  # pragma: no cover
-        if not (attempts := attempt()) % REPORT_INTERVAL:
-            typer.echo(".", nl=False)
-        seed = os.urandom(50)
-        hash = sha256(seed).digest()
+    workers = workers or os.process_cpu_count() or 1
+    attempts, seed = 0, None
+    with ProcessPoolExecutor(workers, mp_context=get_context("forkserver")) as pool:
 
+        def search() -> Future[tuple[int, bytes | None]]:
+            return pool.submit(_search_key, KEY_DIFFICULTY, SEARCH_BATCH_SIZE)
+
+        pending = {search() for _ in range(workers)}
+        while seed is None:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                tried, found = future.result()
+                reported, attempts = attempts // REPORT_INTERVAL, attempts + tried
+                if dots := attempts // REPORT_INTERVAL - reported:
+                    typer.echo("." * dots, nl=False)
+                seed = seed or found
+            if seed is None and stop is not None and stop.is_set():
+                break
+            if seed is None:
+                pending |= {search() for _ in done}
+        for future in pending:
+            future.cancel()
+
+    if seed is None:
+        typer.echo("\nKey search stopped.")
+        raise KeySearchStopped
     typer.echo(f"\nSuccess! Key found after {attempts:,} attempts.")
     return base64.b64encode(seed).decode().rstrip("=")
 
 
+class SmokeshowKeyPool:
+    """A file of pre-mined smokeshow keys, one key per line
+
+    Mining keys ahead of time (see the `pyright-analysis-action keys mine`
+    command) takes the key search off the critical path of an action run.
+    Keys are removed from the pool as they are used.
+
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+
+    def _read(self) -> list[str]:
+        try:
+            return self.path.read_text().split()
+        except FileNotFoundError:
+            return []
+
+    def _write(self, keys: list[str]) -> None:
+        tmp = self.path.with_name(f".{self.path.name}.tmp")
+        tmp.write_text("".join(f"{key}\n" for key in keys))
+        tmp.replace(self.path)
+
+    def __len__(self) -> int:
+        return len(self._read())
+
+    def add(self, keys: Iterable[str]) -> None:
+        self._write([*self._read(), *keys])
+
+    def pop(self) -> str | None:
+        """Remove and return the first key in the pool, or None if it is empty"""
+        if not (keys := self._read()):
+            return None
+        key, *remaining = keys
+        self._write(remaining)
+        return key
+
+
+class UploadStats:
+    """Aggregate throughput of the uploads to a site"""
+
+    def __init__(self) -> None:
+        self.files = self.bytes_sent = self.total_site_size = 0
+        self._started: float | None = None
+        self._finished = 0.0
+
+    def start(self) -> None:
+        if self._started is None:
+            self._started = time.perf_counter()
+
+    def add(self, upload_info: SmokeshowUploadResponse) -> None:
+        self.files += 1
+        self.bytes_sent += upload_info.size
+        self.total_site_size = max(self.total_site_size, upload_info.total_site_size)
+        self._finished = time.perf_counter()
+
+    @property
+    def elapsed(self) -> float:
+        """Seconds from the first upload starting to the last one completing"""
+        return 0.0 if self._started is None else self._finished - self._started
+
+    def __str__(self) -> str:
+        sent, total = (
+            naturalsize(self.bytes_sent, True),
+            naturalsize(self.total_site_size, True),
+        )
+        rate = naturalsize(self.bytes_sent / (self.elapsed or 1), True)
+        return (
+            f"Uploaded {self.files} files ({sent}) in {self.elapsed:.2f}s, "
+            f"{rate}/s, site total {total}"
+        )
+
+
 class SmokeshowSite(AbstractAsyncContextManager["SmokeshowSite"]):
-    def __init__(self, key: str | None = None) -> None:
+    """A smokeshow site, created when entering the context
+
+    At most `max_concurrent_uploads` files are sent to the site at a time;
+    further uploads wait their turn, in the order they were started. Each file
+    is retried on its own when smokeshow has a hiccup, and the combined
+    throughput is reported when the context exits.
+
+    """
+
+    def __init__(
+        self,
+        key: str | None = None,
+        key_pool: SmokeshowKeyPool | None = None,
+        max_concurrent_uploads: int = MAX_CONCURRENT_UPLOADS,
+        connection: ConnectionSettings = DEFAULT_CONNECTION,
+    ) -> None:
+        if max_concurrent_uploads < 1:
+            raise ValueError("max_concurrent_uploads must be at least 1")
         self._key = key
+        self._key_pool = key_pool
+        self._connection = connection
+        self._upload_slots = asyncio.Semaphore(max_concurrent_uploads)
+        self.stats = UploadStats()
 
     @property
     def expiration(self) -> datetime.datetime:
@@ -123,21 +406,59 @@ class SmokeshowSite(AbstractAsyncContextManager["SmokeshowSite"]):
         from . import __version__
 
         self._client = await aiohttp.ClientSession(
-            headers={hdrs.USER_AGENT: USER_AGENT.format(version=__version__)}
+            headers={hdrs.USER_AGENT: USER_AGENT.format(version=__version__)},
+            connector=self._connection.connector(),
+            timeout=self._connection.timeout(),
+            trace_configs=[_timing_trace_config()],
         ).__aenter__()
-        self._create_response = await self.create_site()
+        try:
+            if self._key is None:
+                self._key = self._pooled_key() or await self._mine_key()
+            self._create_response = await self.create_site()
+        except BaseException as exc:
+            await self._client.__aexit__(type(exc), exc, exc.__traceback__)
+            raise
         typer.echo(self._create_response)
         self._client.headers[AUTHORIZATION_HDR] = self._create_response.secret_key
         self._client._base_url = URL(self._create_response.url)  # pyright: ignore[reportPrivateUsage]
         return self
 
+    @property
+    def uses_key_pool(self) -> bool:
+        """Will entering the context take a key from the key pool?
+
+        Use this to create the site only once it is certain to be used.
+        """
+        pool = self._key_pool
+        return self._key is None and pool is not None and len(pool) > 0
+
+    async def _mine_key(self) -> str:
+        """Mine a key in a worker thread, so the event loop stays responsive
+
+        A thread can't be cancelled, so the search is told to stop instead
+        when the task creating the site is cancelled.
+        """
+        stop = threading.Event()
+        try:
+            return await asyncio.to_thread(generate_smokeshow_key, stop=stop)
+        finally:
+            stop.set()
+
+    def _pooled_key(self) -> str | None:
+        if self._key_pool is None or (key := self._key_pool.pop()) is None:
+            return None
+        remaining = len(self._key_pool)
+        typer.echo(
+            f"Using a pre-mined smokeshow key from {self._key_pool.path} "
+            f"({remaining:,} remaining)"
+        )
+        return key
+
     @_smokeshow_retry
     async def create_site(self) -> SmokeshowCreateResponse:
-        key = self._key
-        if key is None:
-            key = generate_smokeshow_key()
+        assert self._key is not None
         async with self._client.post(
-            SMOKESHOW_CREATE, headers={AUTHORIZATION_HDR: key}
+            SMOKESHOW_CREATE, headers={AUTHORIZATION_HDR: self._key}
         ) as response:
             response.raise_for_status()
             return SmokeshowCreateResponse.model_validate_json(await response.read())
@@ -148,36 +469,43 @@ class SmokeshowSite(AbstractAsyncContextManager["SmokeshowSite"]):
         exc_value: BaseException | None,
         traceback: types.TracebackType | None,
     ) -> bool | None:
+        if exc_type is None and self.stats.files:
+            typer.echo(self.stats)
         return await self._client.__aexit__(exc_type, exc_value, traceback)
 
-    @_smokeshow_retry
-    async def upload(self, name: str, data: bytes, content_type: str) -> URL:
-        async with self._client.post(
-            name, headers={hdrs.CONTENT_TYPE: content_type}, data=data
-        ) as response:
-            response.raise_for_status()
-            upload_info = SmokeshowUploadResponse.model_validate_json(
-                await response.read()
-            )
+    async def upload(
+        self, name: str, data: UploadData, content_type: str, saved: int = 0
+    ) -> URL:
+        """Upload a file
+
+        Text and files of `CHUNK_SIZE` or more are streamed rather than held in
+        memory as a single copy of the encoded contents. `saved`, the bytes
+        saved by minifying the contents, is reported with the upload.
+        """
+        if isinstance(data, str) and len(data) < CHUNK_SIZE:
+            data = data.encode()
+        headers = {hdrs.CONTENT_TYPE: content_type}
+        if isinstance(data, str):
+            # avoids chunked transfer encoding for the streamed text
+            size = await asyncio.to_thread(utf8_size, data)
+            headers[hdrs.CONTENT_LENGTH] = str(size)
+        async with self._upload_slots:
+            self.stats.start()
+            url, upload_info = await self._post(name, data, headers)
+        self.stats.add(upload_info)
+        if saved:
+            upload_info = upload_info.model_copy(update={"saved": saved})
         typer.secho(upload_info, italic=True)
-        return response.url
-
-
-async def upload(
-    key: str | None, html_page: str, preview_image: bytes
-) -> tuple[datetime.datetime, URL, URL]:
-    async with SmokeshowSite(key) as site:
-        async with asyncio.TaskGroup() as group:
-            html_task = group.create_task(
-                site.upload("index.html", html_page.encode(), "text/html"),
-                name="html_upload",
-            )
-            image_task = group.create_task(
-                site.upload("preview.svg", preview_image, "image/svg+xml"),
-                name="preview_upload",
-            )
-        html_url = html_task.result()
-        if html_url.parts[-1] == "index.html":  # pragma: no cover
-            html_url = html_url.parent
-        image_url = image_task.result()
-        return site.expiration, html_url, image_url
+        return url
+
+    @_smokeshow_retry
+    async def _post(
+        self, name: str, data: UploadData, headers: dict[str, str]
+    ) -> tuple[URL, SmokeshowUploadResponse]:
+        with _request_body(data) as body:
+            async with self._client.post(name, headers=headers, data=body) as response:
+                response.raise_for_status()
+                upload_info = SmokeshowUploadResponse.model_validate_json(
+                    await response.read()
+                )
+        return response.url, upload_info
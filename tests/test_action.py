@@ -1,15 +1,32 @@
+import asyncio
 import datetime
-from collections.abc import Iterator
+from collections.abc import Awaitable, Iterator
 from io import StringIO
-from typing import cast
-from unittest.mock import MagicMock, patch
+from pathlib import Path
+from typing import Any
+from unittest.mock import AsyncMock, MagicMock, patch
 
 import pytest
 import typer
 from yarl import URL
 
-from pyright_analysis_action.action import action
-from pyright_analysis_action.comment import NotCommenting
+from pyright_analysis_action._render import FigureEncoding, PlotlyJS, PreviewRenderer
+from pyright_analysis_action._utils import set_outputs
+from pyright_analysis_action.action import (
+    DEFAULT_TEMPLATE,
+    action,
+    batch_prefixes,
+    expand_reports,
+    summarise,
+)
+from pyright_analysis_action.comment import (
+    CommentOrder,
+    NotCommenting,
+    PublishedPage,
+    PublishedSite,
+)
+from pyright_analysis_action.publish import LocalSite, Minified, Publisher, Site
+from pyright_analysis_action.smokeshow import MAX_CONCURRENT_UPLOADS, SmokeshowKeyPool
 
 
 class TestAction:
@@ -20,45 +37,244 @@ class TestAction:
     )
 
     @pytest.fixture(autouse=True)
-    def _setup(self, pyright_json_report: str) -> Iterator[None]:
-        self.report = cast(typer.FileText, StringIO(pyright_json_report))
+    def _setup(self, tmp_path: Path, pyright_json_report: str) -> Iterator[None]:
+        self.report = tmp_path / "report.json"
+        self.report.write_text(pyright_json_report)
         with (
             patch(
                 "pyright_analysis.treemap.to_treemap", autospec=True
             ) as self.mock_to_treemap,
+            patch(
+                "pyright_analysis_action.action.SmokeshowSite", autospec=True
+            ) as self.mock_site,
+            patch(
+                "pyright_analysis_action.action.ImageRenderer", autospec=True
+            ) as self.mock_renderer,
             patch(
                 "pyright_analysis_action.action.upload", autospec=True
             ) as self.mock_upload,
             patch(
                 "pyright_analysis_action.action.set_outputs", autospec=True
             ) as self.mock_set_outputs,
+            patch(
+                "pyright_analysis_action.action.encode_figure",
+                autospec=True,
+                return_value=({"data": [], "layout": {}}, 0),
+            ) as self.mock_encode_figure,
+            patch(
+                "plotly.io.to_html", autospec=True, return_value="<html/>"
+            ) as self.mock_to_html,
         ):
-            figure: MagicMock = self.mock_to_treemap.return_value
-            self.mock_to_html: MagicMock = figure.to_html
-            self.mock_to_html.return_value = "<html/>"
-            self.mock_to_image: MagicMock = figure.to_image
+            renderer = self.mock_renderer.return_value.__aenter__.return_value
+            self.mock_to_image: MagicMock = renderer.to_image
             self.mock_to_image.return_value = b"<svg/>"
-            self.mock_upload.return_value = self.upload_result
+            self.mock_site.return_value.uses_key_pool = False
+            self.mock_upload.side_effect = self.upload
+            self.uploaded: list[tuple[str, bytes]] = []
+            self.saved: list[int] = []
             yield
 
+    async def upload(
+        self,
+        site: Site,
+        html_page: Path | Minified | Awaitable[Path | Minified],
+        preview: bytes | Awaitable[bytes],
+        prefix: str = "",
+    ) -> tuple[datetime.datetime, URL, URL]:
+        """Record the uploaded contents, before the rendered page is removed"""
+        if not isinstance(html_page, Path | Minified):
+            html_page = await html_page
+        page = html_page
+        if isinstance(html_page, Minified):
+            self.saved.append(html_page.saved)
+            page = html_page.data
+        assert isinstance(page, Path)
+        if not isinstance(preview, bytes):
+            preview = await preview
+        self.uploaded.append((page.read_text(), preview))
+        return self.upload_result
+
+    def assert_uploaded(self, html_page: str, preview: bytes) -> None:
+        self.mock_upload.assert_called_once()
+        site = self.mock_upload.call_args.args[0]
+        assert site is self.mock_site.return_value.__aenter__.return_value
+        assert self.uploaded == [(html_page, preview)]
+
     @pytest.mark.parametrize("div_id", (None, "some-div-id"))
     def test_html_args_passthrough(self, div_id: str | None) -> None:
-        action(self.report, div_id=div_id)
+        action([self.report], div_id=div_id)
+        figure = self.mock_to_treemap.return_value
+        self.mock_encode_figure.assert_called_once_with(figure, FigureEncoding.json)
+        self.mock_to_html.assert_called_once_with(
+            {"data": [], "layout": {}},
+            validate=False,
+            div_id=div_id,
+            full_html=True,
+            include_plotlyjs="cdn",
+        )
+
+    @pytest.mark.parametrize("template", (None, "<html>{{graph}}</html>"))
+    def test_inline_plotlyjs(self, tmp_path: Path, template: str | None) -> None:
+        bundle = tmp_path / "plotly-treemap.min.js"
+        bundle.write_text(r"Plotly.treemap = /\d+/;")
+        self.mock_to_html.return_value = "<div/>"
+        action(
+            [self.report],
+            template=template,
+            plotlyjs=PlotlyJS.inline,
+            plotlyjs_bundle=bundle,
+        )
         self.mock_to_html.assert_called_once_with(
-            div_id=div_id, full_html=True, include_plotlyjs="cdn"
+            {"data": [], "layout": {}},
+            validate=False,
+            div_id=None,
+            full_html=False,
+            include_plotlyjs=False,
         )
+        script = r'<script type="text/javascript">Plotly.treemap = /\d+/;</script>'
+        graph = f"{script}<div/>"
+        expected = (template or DEFAULT_TEMPLATE).replace("{{ graph }}", graph)
+        self.assert_uploaded(expected.replace("{{graph}}", graph), b"<svg/>")
+
+    @pytest.mark.parametrize(
+        "encoding", (FigureEncoding.minified, FigureEncoding.compact)
+    )
+    def test_figure_encoding(self, tmp_path: Path, encoding: FigureEncoding) -> None:
+        self.mock_to_html.return_value = "<html>small</html>"
+        self.mock_encode_figure.return_value = ({"data": []}, 4096)
+        cache = tmp_path / "cache"
+        action([self.report], figure_encoding=encoding, render_cache=cache)
+        figure = self.mock_to_treemap.return_value
+        self.mock_encode_figure.assert_called_once_with(figure, encoding)
+        self.mock_to_html.assert_called_once_with(
+            {"data": []},
+            validate=False,
+            div_id=None,
+            full_html=True,
+            include_plotlyjs="cdn",
+        )
+        # the saving is reported with the upload
+        self.assert_uploaded("<html>small</html>", b"<svg/>")
+        assert self.saved == [4096]
+        ((entry,),) = [list(cache.iterdir())]
+        assert (entry / "index.html").read_text() == "<html>small</html>"
+
+    def test_inline_plotlyjs_default_bundle(self) -> None:
+        with patch(
+            "pyright_analysis_action.action.get_plotlyjs",
+            autospec=True,
+            return_value="full_bundle();",
+        ):
+            action([self.report], plotlyjs=PlotlyJS.inline)
+        ((html_page, _),) = self.uploaded
+        assert "full_bundle();" in html_page
 
     @pytest.mark.parametrize("smokeshow_auth_key", (None, "some-test-value"))
     def test_upload_key_passthrough(self, smokeshow_auth_key: str | None) -> None:
-        action(self.report, smokeshow_auth_key=smokeshow_auth_key)
-        self.mock_upload.assert_called_once_with(
-            smokeshow_auth_key, "<html/>", b"<svg/>"
+        action([self.report], smokeshow_auth_key=smokeshow_auth_key)
+        self.mock_site.assert_called_once_with(
+            smokeshow_auth_key,
+            None,
+            max_concurrent_uploads=MAX_CONCURRENT_UPLOADS,
         )
+        self.assert_uploaded("<html/>", b"<svg/>")
+        self.mock_site.return_value.__aexit__.assert_called_once()
+
+    def test_upload_concurrency_passthrough(self) -> None:
+        action([self.report], upload_concurrency=8)
+        assert self.mock_site.call_args.kwargs["max_concurrent_uploads"] == 8
+
+    def test_publish_locally(self, tmp_path: Path) -> None:
+        directory = tmp_path / "site"
+        action(
+            [self.report],
+            publisher=Publisher.local,
+            publish_directory=directory,
+            publish_base_url="http://artifacts.example.com/run/",
+        )
+        self.mock_site.assert_not_called()
+        site = self.mock_upload.call_args.args[0]
+        assert isinstance(site, LocalSite)
+        assert site.directory == directory
+        assert site.base_url == URL("http://artifacts.example.com/run/")
+
+    def test_publish_locally_requires_directory(self) -> None:
+        with pytest.raises(typer.BadParameter):
+            action([self.report], publisher=Publisher.local)
+
+    def test_preview_rendered(self) -> None:
+        action([self.report])
+        figure = self.mock_to_treemap.return_value
+        self.mock_to_image.assert_awaited_once_with(figure, "svg", scale=0.5)
+        self.mock_renderer.return_value.__aexit__.assert_called_once()
+
+    def test_native_preview_rendered(self) -> None:
+        with patch(
+            "pyright_analysis_action.action.render_svg",
+            autospec=True,
+            return_value=b"<svg native/>",
+        ) as mock_render_svg:
+            action([self.report], preview_renderer=PreviewRenderer.native)
+        figure = self.mock_to_treemap.return_value
+        mock_render_svg.assert_called_once_with(figure, scale=0.5)
+        self.mock_renderer.assert_not_called()
+        self.assert_uploaded("<html/>", b"<svg native/>")
+
+    def test_render_cache(self, tmp_path: Path) -> None:
+        cache = tmp_path / "cache"
+        action([self.report], render_cache=cache)
+        self.assert_uploaded("<html/>", b"<svg/>")
+        assert len(list(cache.iterdir())) == 1
+
+        self.mock_to_treemap.reset_mock()
+        self.mock_renderer.reset_mock()
+        self.mock_upload.reset_mock()
+        self.uploaded.clear()
+        action([self.report], render_cache=cache)
+        self.mock_to_treemap.assert_not_called()
+        self.mock_renderer.assert_not_called()
+        self.assert_uploaded("<html/>", b"<svg/>")
+
+        # a different input is a cache miss
+        action([self.report], render_cache=cache, div_id="other")
+        self.mock_to_treemap.assert_called_once()
+        assert len(list(cache.iterdir())) == 2
+
+    def test_key_pool_passthrough(self, tmp_path: Path) -> None:
+        pool_path = tmp_path / "keys.txt"
+        action([self.report], smokeshow_key_pool=pool_path)
+        _, key_pool = self.mock_site.call_args.args
+        assert isinstance(key_pool, SmokeshowKeyPool)
+        assert key_pool.path == pool_path
+
+    def test_key_pool_site_created_after_rendering(self, tmp_path: Path) -> None:
+        site = self.mock_site.return_value
+        site.uses_key_pool = True
+
+        async def to_image(*args: object, **kwargs: object) -> bytes:
+            # rendering finishes before the site (and its key) is taken
+            await asyncio.sleep(0)
+            site.__aenter__.assert_not_called()
+            return b"<svg/>"
+
+        self.mock_to_image.side_effect = to_image
+        action([self.report], smokeshow_key_pool=tmp_path / "keys.txt")
+        site.__aenter__.assert_called_once()
+        self.assert_uploaded("<html/>", b"<svg/>")
+
+    def test_key_pool_unused_when_rendering_fails(self, tmp_path: Path) -> None:
+        site = self.mock_site.return_value
+        site.uses_key_pool = True
+        self.mock_to_image.side_effect = RuntimeError("browser crashed")
+        with pytest.raises(ExceptionGroup):
+            action([self.report], smokeshow_key_pool=tmp_path / "keys.txt")
+        site.__aenter__.assert_not_called()
+        self.mock_upload.assert_not_called()
 
     def test_template_and_template_file(self):
         with pytest.raises(typer.BadParameter):
             action(
-                self.report,
+                [self.report],
                 template="<html><head/>{{graph}}</html>",
                 template_file=MagicMock(),
             )
@@ -66,28 +282,28 @@ class TestAction:
     @pytest.mark.parametrize("template", ("<html/>", StringIO("<html/>")))
     def test_template_lacking_slot(self, template: str | typer.FileText) -> None:
         with pytest.raises(typer.BadParameter):
-            action(self.report, template=template) if isinstance(
+            action([self.report], template=template) if isinstance(
                 template, str
-            ) else action(self.report, template_file=template)
+            ) else action([self.report], template_file=template)
 
     @pytest.mark.parametrize(
         "template", ("<html>{{graph}}</html>", StringIO("<html>{{graph}}</html>"))
     )
     def test_template(self, template: str | typer.FileText) -> None:
         self.mock_to_html.return_value = "<div/>"
-        action(self.report, template=template) if isinstance(template, str) else action(
-            self.report, template_file=template
-        )
-        self.mock_upload.assert_called_once_with(None, "<html><div/></html>", b"<svg/>")
+        action([self.report], template=template) if isinstance(
+            template, str
+        ) else action([self.report], template_file=template)
+        self.assert_uploaded("<html><div/></html>", b"<svg/>")
 
     def test_outputs_set(self):
         output = MagicMock()
-        action(self.report, output=output)
+        action([self.report], output=output)
         expiration, html_url, preview_url = self.upload_result
         self.mock_set_outputs.assert_called_once_with(
             output,
-            html_url=html_url,
-            preview_url=preview_url,
+            html_url=str(html_url),
+            preview_url=str(preview_url),
             expiration=expiration.isoformat(),
             comment_url=None,
         )
@@ -102,13 +318,27 @@ class TestAction:
             patch("typer.secho", autospec=True) as mock_secho,
         ):
             action(
-                self.report,
+                [self.report],
                 comment_on_pr=True,
                 event_name="some_event",
                 event_file=MagicMock(),
             )
         mock_secho.assert_any_call("Skipping posting a PR comment: mocked", dim=True)
 
+    def test_comment_search_passthrough(self) -> None:
+        with patch(
+            "pyright_analysis_action.action.Commenter", autospec=True
+        ) as mocked_commenter:
+            action(
+                [self.report],
+                comment_on_pr=True,
+                comment_search=CommentOrder.newest_first,
+                event_name="some_event",
+                event_file=MagicMock(),
+            )
+        order = mocked_commenter.from_event.call_args.args[3]
+        assert order is CommentOrder.newest_first
+
     def test_commenting(self) -> None:
         output = MagicMock()
         with (
@@ -122,7 +352,7 @@ class TestAction:
             post_call = mocked_commenter.from_event.return_value.post_or_update_comment
             post_call.return_value = "http://example.com/"
             action(
-                self.report,
+                [self.report],
                 comment_on_pr=True,
                 event_name="some_event",
                 event_file=MagicMock(),
@@ -132,8 +362,258 @@ class TestAction:
         expiration, html_url, preview_url = self.upload_result
         self.mock_set_outputs.assert_called_once_with(
             output,
-            html_url=html_url,
-            preview_url=preview_url,
+            html_url=str(html_url),
+            preview_url=str(preview_url),
             expiration=expiration.isoformat(),
             comment_url="http://example.com/",
         )
+
+    def _run_commenting(
+        self, existing: PublishedSite | None, **options: Any
+    ) -> MagicMock:
+        """Run the action with deduplication, returning the mocked commenter"""
+        with patch(
+            "pyright_analysis_action.action.Commenter", autospec=True
+        ) as mocked_commenter:
+            commenter = mocked_commenter.from_event.return_value
+            commenter.existing_comment.return_value = existing and (
+                "IC_node_id",
+                f"summary\n{existing.marker}",
+            )
+            commenter.post_or_update_comment.return_value = "http://example.com/"
+            action(
+                [self.report],
+                comment_on_pr=True,
+                deduplicate=True,
+                event_name="some_event",
+                event_file=MagicMock(),
+                **options,
+            )
+        commenter.existing_comment.assert_awaited_once()
+        return commenter
+
+    @pytest.mark.parametrize(
+        "changes",
+        (
+            {},
+            {"div_id": "other-div"},
+            {"preview_renderer": PreviewRenderer.native},
+            {"publisher": Publisher.local},
+        ),
+        ids=("unchanged", "div_id", "preview_renderer", "publisher"),
+    )
+    def test_deduplicate(self, tmp_path: Path, changes: dict[str, Any]) -> None:
+        if changes.get("publisher") is Publisher.local:
+            changes["publish_directory"] = tmp_path / "site"
+        # the first run publishes, and records the site in the comment
+        commenter = self._run_commenting(None)
+        _, comment_id, first_site = commenter.post_or_update_comment.call_args.args
+        assert comment_id is None
+        assert first_site.content_hash is not None
+        site = first_site.model_copy(
+            update={
+                "expiration": datetime.datetime.now(tz=datetime.UTC)
+                + datetime.timedelta(days=2)
+            }
+        )
+
+        self.mock_site.reset_mock()
+        self.mock_upload.reset_mock()
+        self.uploaded.clear()
+        output = MagicMock()
+        with patch(
+            "pyright_analysis_action.action.render_svg",
+            autospec=True,
+            return_value=b"<svg/>",
+        ):
+            commenter = self._run_commenting(site, output=output, **changes)
+
+        _, comment_id, posted_site = commenter.post_or_update_comment.call_args.args
+        assert comment_id == "IC_node_id"
+        if not changes:
+            self.mock_site.assert_not_called()
+            self.mock_upload.assert_not_called()
+            assert posted_site == site
+        else:
+            self.mock_upload.assert_called_once()
+            assert self.uploaded == [("<html/>", b"<svg/>")]
+            assert posted_site.content_hash != site.content_hash
+        self.mock_set_outputs.assert_called_with(
+            output,
+            html_url=posted_site.html_url,
+            preview_url=posted_site.pages[0].preview_url,
+            expiration=posted_site.expiration.isoformat(),
+            comment_url="http://example.com/",
+        )
+
+    def test_comment_lookup_concurrent(self) -> None:
+        # without deduplication, publishing doesn't wait for the comment lookup
+        looked_up = asyncio.Event()
+
+        async def existing_comment() -> None:
+            await asyncio.wait_for(looked_up.wait(), timeout=5)
+
+        async def upload(
+            *args: Any, **kwargs: Any
+        ) -> tuple[datetime.datetime, URL, URL]:
+            looked_up.set()
+            return self.upload_result
+
+        self.mock_upload.side_effect = upload
+        with patch(
+            "pyright_analysis_action.action.Commenter", autospec=True
+        ) as mocked_commenter:
+            commenter = mocked_commenter.from_event.return_value
+            commenter.existing_comment.side_effect = existing_comment
+            commenter.post_or_update_comment.return_value = "http://example.com/"
+            action(
+                [self.report],
+                comment_on_pr=True,
+                event_name="some_event",
+                event_file=MagicMock(),
+            )
+        commenter.post_or_update_comment.assert_awaited_once()
+
+    def test_comment_lookup_cancelled(self) -> None:
+        cancelled = False
+
+        async def existing_comment() -> None:
+            nonlocal cancelled
+            try:
+                await asyncio.Event().wait()
+            except asyncio.CancelledError:
+                cancelled = True
+                raise
+
+        self.mock_to_image.side_effect = RuntimeError("browser crashed")
+        with patch(
+            "pyright_analysis_action.action.Commenter", autospec=True
+        ) as mocked_commenter:
+            commenter = mocked_commenter.from_event.return_value
+            commenter.existing_comment.side_effect = existing_comment
+            with pytest.raises(ExceptionGroup):
+                action(
+                    [self.report],
+                    comment_on_pr=True,
+                    event_name="some_event",
+                    event_file=MagicMock(),
+                )
+        assert cancelled
+        commenter.post_or_update_comment.assert_not_called()
+
+    def test_batch(self, tmp_path: Path, pyright_json_report: str) -> None:
+        for name, package_name in (("other", "spam"), ("dots", "../escape")):
+            (tmp_path / f"{name}.json").write_text(
+                pyright_json_report.replace(
+                    '"packageName": "foobar"', f'"packageName": "{package_name}"'
+                )
+            )
+        site = self.mock_site.return_value.__aenter__.return_value
+        site.upload = AsyncMock(return_value=URL("http://example.com/site/index.html"))
+
+        async def upload(
+            *args: Any, prefix: str = ""
+        ) -> tuple[datetime.datetime, URL, URL]:
+            await self.upload(*args, prefix=prefix)
+            base = URL(f"http://example.com/site/{prefix}")
+            return self.upload_result[0], base, base / "preview.svg"
+
+        self.mock_upload.side_effect = upload
+        self.mock_set_outputs.side_effect = set_outputs
+        output = MagicMock()
+        # newline-separated paths, as passed in by the report action input
+        action([Path(f"{tmp_path / '*.json'}\n{self.report}\n")], output=output)
+
+        # directories are assigned in report order, not in render order
+        prefixes = ["-escape/", "spam/", "foobar/", "foobar-2/"]
+        uploaded = sorted(c.kwargs["prefix"] for c in self.mock_upload.call_args_list)
+        assert uploaded == sorted(prefixes)
+        self.mock_renderer.assert_called_once_with(4)
+        name, index_page, content_type = site.upload.call_args.args
+        assert (name, content_type) == ("index.html", "text/html")
+        positions: list[int] = []
+        for prefix in prefixes:
+            # absolute links, the site URL has no trailing slash
+            url = f"http://example.com/site/{prefix}"
+            positions.append(index_page.index(f'<a href="{url}">'))
+            assert f'<img src="{url}preview.svg"' in index_page
+        assert positions == sorted(positions)
+        expiration = self.upload_result[0]
+        (written,) = output.write.call_args.args
+        assert written.splitlines() == [
+            "html_url=http://example.com/site",
+            "preview_url=",
+            f"expiration={expiration.isoformat()}",
+            "comment_url=None",
+        ]
+
+
+def test_expand_reports(tmp_path: Path) -> None:
+    for name in ("foo.json", "bar.json", "spam.txt", "with space.txt"):
+        (tmp_path / name).touch()
+    assert expand_reports([tmp_path / "*.json", tmp_path / "spam.txt"]) == [
+        tmp_path / "bar.json",
+        tmp_path / "foo.json",
+        tmp_path / "spam.txt",
+    ]
+    lines = f"{tmp_path / 'with space.txt'}\n\n{tmp_path / 'spam.txt'}\n"
+    assert expand_reports([Path(lines)]) == [
+        tmp_path / "with space.txt",
+        tmp_path / "spam.txt",
+    ]
+    with pytest.raises(typer.BadParameter):
+        expand_reports([tmp_path / "*.xml"])
+    with pytest.raises(typer.BadParameter):
+        expand_reports([tmp_path / "missing.json"])
+
+
+def test_batch_prefixes() -> None:
+    assert batch_prefixes(["foo", "foo.bar", "..", "a b/c", "foo", "foo-2"]) == [
+        "foo/",
+        "foo.bar/",
+        "package/",
+        "a-b-c/",
+        "foo-2/",
+        "foo-2-2/",
+    ]
+
+
+def test_summarise_batch() -> None:
+    site = PublishedSite(
+        content_hash=None,
+        html_url="http://example.com/site",
+        expiration=datetime.datetime(2026, 1, 1, tzinfo=datetime.UTC),
+        pages=[
+            PublishedPage(
+                package_name=name,
+                html_url=f"http://example.com/site/{name}",
+                preview_url=f"http://example.com/site/{name}/preview.svg",
+            )
+            for name in ("foo", "bar")
+        ],
+    )
+    summary = summarise(site)
+    assert "[overview of all 2 packages](http://example.com/site)" in summary
+    assert "### [`bar`](http://example.com/site/bar)" in summary
+    assert "(http://example.com/site/foo/preview.svg)" in summary
+    assert "*Pages available until 2026-01-01T00:00:00+00:00.*" in summary
+
+
+@pytest.mark.parametrize("count", (1, 2))
+def test_summarise_never_expires(count: int) -> None:
+    site = PublishedSite(
+        content_hash=None,
+        html_url="file:///site/index.html",
+        expiration=None,
+        pages=[
+            PublishedPage(
+                package_name=f"package{i}",
+                html_url=f"file:///site/package{i}/index.html",
+                preview_url=f"file:///site/package{i}/preview.svg",
+            )
+            for i in range(count)
+        ],
+    )
+    summary = summarise(site)
+    assert "available until" not in summary
+    assert summary.endswith(")\n")
@@ -0,0 +1,88 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import pytest
+
+from pyright_analysis_action._cache import RenderCache, RenderedReport
+
+
+@pytest.fixture
+def report(tmp_path: Path, pyright_json_report: str) -> Path:
+    report = tmp_path / "report.json"
+    report.write_text(pyright_json_report)
+    return report
+
+
+def test_key(report: Path, tmp_path: Path) -> None:
+    key = RenderCache.key(report, div_id=None, template=None)
+    assert key == RenderCache.key(report, div_id=None, template=None)
+    assert key != RenderCache.key(report, div_id="foo", template=None)
+    assert key != RenderCache.key(report, div_id=None, template="{{graph}}")
+
+    other = tmp_path / "other.json"
+    other.write_text(report.read_text().replace("foobar", "spam"))
+    assert key != RenderCache.key(other, div_id=None, template=None)
+
+
+def _html_page(tmp_path: Path, contents: str) -> Path:
+    html_page = tmp_path / "rendered.html"
+    html_page.write_text(contents)
+    return html_page
+
+
+def test_roundtrip(tmp_path: Path) -> None:
+    cache = RenderCache(tmp_path / "cache")
+    assert cache.get("some-key") is None
+    rendered = RenderedReport("foobar", _html_page(tmp_path, "<html/>"), b"<svg/>")
+    cache.put("some-key", rendered)
+    cached = cache.get("some-key")
+    assert cached is not None
+    assert cached.html_page.read_text() == "<html/>"
+    assert cached._replace(html_page=rendered.html_page) == rendered
+    cache.put("some-key", rendered._replace(html_page=_html_page(tmp_path, "new")))
+    cached = cache.get("some-key")
+    assert cached is not None and cached.html_page.read_text() == "new"
+
+
+def test_evicts_least_recently_used(tmp_path: Path) -> None:
+    cache = RenderCache(tmp_path / "cache", max_size=50)
+    html_page = _html_page(tmp_path, "<html/>" * 3)
+    rendered = RenderedReport("foobar", html_page, b"<svg/>")  # 33 bytes
+    cache.put("first", rendered)
+    os.utime(tmp_path / "cache/first", (0, 0))
+    cache.put("second", rendered)
+    assert cache.get("first") is None
+    assert cache.get("second") is not None
+
+
+def test_keeps_entries_in_use(tmp_path: Path) -> None:
+    cache = RenderCache(tmp_path / "cache", max_size=50)
+    html_page = _html_page(tmp_path, "<html/>" * 3)
+    rendered = RenderedReport("foobar", html_page, b"<svg/>")  # 33 bytes
+    cache.put("first", rendered)
+    cached = cache.get("first")
+    assert cached is not None
+    os.utime(tmp_path / "cache/first", (0, 0))
+    cache.put("second", rendered)
+    # the page of the first entry may still be uploaded
+    assert cached.html_page.read_text() == "<html/>" * 3
+
+
+@pytest.mark.parametrize("shared", (True, False), ids=("shared", "per-thread"))
+def test_concurrent_puts(tmp_path: Path, shared: bool) -> None:
+    # batch renders store their results from several threads at once, and
+    # other processes may be evicting entries from the same directory
+    directory = tmp_path / "cache"
+    html_page = _html_page(tmp_path, "<html/>" * 1000)
+    rendered = RenderedReport("foobar", html_page, b"<svg/>")
+    shared_cache = RenderCache(directory, max_size=30000)
+
+    def put_all(thread: int) -> None:
+        cache = shared_cache if shared else RenderCache(directory, max_size=30000)
+        for i in range(20):
+            cache.put(f"{thread}-{i}", rendered)
+
+    with ThreadPoolExecutor(4) as pool:
+        list(pool.map(put_all, range(4)))
+    assert 0 < len(list(directory.iterdir())) <= 4
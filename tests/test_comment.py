@@ -1,16 +1,24 @@
-from datetime import UTC, datetime
+import json
+from datetime import UTC, datetime, timedelta
+from functools import partial
 from io import StringIO
 from typing import Any, cast
 from unittest.mock import AsyncMock, Mock, patch
 
+import httpx
 import pytest
 from githubkit import GitHub
+from githubkit.exception import GitHubException, RequestFailed, RequestTimeout
 from respx import Route
 from typer import FileText
 
 from pyright_analysis_action.comment import (
     Commenter,
+    CommentOrder,
     NotCommenting,
+    PublishedPage,
+    PublishedSite,
+    pr_from_commit,
     pr_from_workflow_run,
 )
 
@@ -131,6 +139,78 @@ class TestPrFromWorkflow:
             created_at=datetime.now(UTC),
         )
         assert result == "PR_target"
+        # the head sha matched, so no commit history was needed
+        assert graphql_mock.call_count == 1
+
+    @pytest.mark.parametrize(
+        "head_sha",
+        (
+            # a commit since pushed on top of
+            "0aad69efa8f32199f5eb0bdf8b0bb17928167251",
+            # the head before a force push
+            "680c0703082f432a282ccee847661c5927efb785",
+        ),
+    )
+    async def test_multiple_prs_history(
+        self,
+        github: GitHub[Any],
+        graphql_mock: Route,
+        head_sha: str,
+    ) -> None:
+        nodes = [
+            _prs_node(
+                "R_head_repository",
+                "PR_wrong_target",
+                "9b3f1c1ff8a54d2c5e1f3ea1d6b0c4f4a3e2d1c0",
+            ),
+            _prs_node(
+                "R_head_repository",
+                "PR_target",
+                "0aad69efa8f32199f5eb0bdf8b0bb17928167251",
+                "a2b5cddc27ee26bd7ea1982bebc7fb43fe7de789",
+                force_push="680c0703082f432a282ccee847661c5927efb785",
+            ),
+        ]
+        graphql_mock.side_effect = [
+            httpx.Response(200, json=_prs_for_branch_base(*nodes)),
+            httpx.Response(200, json={"data": {"nodes": nodes}}),
+        ]
+        result = await pr_from_workflow_run(
+            github,
+            "R_somerepo",
+            "R_head_repository",
+            "some_branch_name",
+            head_sha,
+            created_at=datetime.now(UTC),
+        )
+        assert result == "PR_target"
+        req = graphql_mock.calls.last.request
+        assert json.loads(req.content)["variables"]["ids"] == [
+            "PR_wrong_target",
+            "PR_target",
+        ]
+
+    async def test_multiple_prs_unknown_sha(
+        self,
+        github: GitHub[Any],
+        graphql_mock: Route,
+        multiple_prs_response: dict[str, Any],
+    ) -> None:
+        nodes = multiple_prs_response["data"]["node"]["pullRequests"]["nodes"]
+        graphql_mock.side_effect = [
+            httpx.Response(200, json=multiple_prs_response),
+            httpx.Response(200, json={"data": {"nodes": nodes}}),
+        ]
+        result = await pr_from_workflow_run(
+            github,
+            "R_somerepo",
+            "R_head_repository",
+            "some_branch_name",
+            "ffffffffffffffffffffffffffffffffffffffff",
+            created_at=datetime.now(UTC),
+        )
+        # falls back to the most recently updated PR
+        assert result == "PR_wrong_target"
 
 
 class TestCommenterFromEvent:
@@ -171,6 +251,11 @@ class TestCommenterFromEvent:
                 autospec=True,
                 return_value=event,
             ),
+            patch(
+                "pyright_analysis_action.comment.pr_from_commit",
+                autospec=True,
+                return_value=None,
+            ),
             patch(
                 "pyright_analysis_action.comment.pr_from_workflow_run",
                 autospec=True,
@@ -180,12 +265,49 @@ class TestCommenterFromEvent:
         ):
             await Commenter.from_event(Mock(), event_name, self.event_file)
 
-    async def test_from_pull_request(self) -> None:
+    async def test_from_pull_request(
+        self, github: GitHub[Any], graphql_mock: Route
+    ) -> None:
+        graphql_mock.respond(
+            json={
+                "data": {
+                    "q0": {"pullRequest": {"id": "PR_node_id"}},
+                    "q1": {
+                        "pullRequest": {
+                            "comments": {
+                                "nodes": [],
+                                "pageInfo": {"endCursor": None, "hasNextPage": False},
+                            }
+                        }
+                    },
+                }
+            }
+        )
+        with patch(
+            "pyright_analysis_action.comment.parse",
+            autospec=True,
+            return_value=Mock(repository=Mock(node_id="R_node_id"), number=42),
+        ):
+            instance = await Commenter.from_event(
+                github, "pull_request", self.event_file
+            )
+        assert instance.pr == "PR_node_id"
+        # the first page of comments came with the PR id, in a single request
+        assert await instance.existing_comment_id() is None
+        assert graphql_mock.call_count == 1
+
+    async def test_from_workflow_run_pull_requests(self) -> None:
         with (
             patch(
                 "pyright_analysis_action.comment.parse",
                 autospec=True,
-                return_value=Mock(repository=Mock(node_id="R_node_id"), number=42),
+                return_value=Mock(
+                    workflow_run=Mock(
+                        event="pull_request",
+                        pull_requests=[Mock(number=42)],
+                    ),
+                    repository=Mock(node_id="R_node_id"),
+                ),
             ),
             patch(
                 "pyright_analysis_action.comment.pr_id_from_number",
@@ -194,11 +316,11 @@ class TestCommenterFromEvent:
             ),
         ):
             instance = await Commenter.from_event(
-                Mock(), "pull_request", self.event_file
+                Mock(), "workflow_run", self.event_file
             )
         assert instance.pr == "PR_node_id"
 
-    async def test_from_workflow_run_pull_requests(self) -> None:
+    async def test_from_workflow_run_from_head_commit(self) -> None:
         with (
             patch(
                 "pyright_analysis_action.comment.parse",
@@ -206,21 +328,28 @@ class TestCommenterFromEvent:
                 return_value=Mock(
                     workflow_run=Mock(
                         event="pull_request",
-                        pull_requests=[Mock(number=42)],
+                        pull_requests=[],
+                        head_branch="some_branch",
                     ),
                     repository=Mock(node_id="R_node_id"),
                 ),
             ),
             patch(
-                "pyright_analysis_action.comment.pr_id_from_number",
+                "pyright_analysis_action.comment.pr_from_commit",
                 autospec=True,
                 return_value="PR_node_id",
             ),
+            patch(
+                "pyright_analysis_action.comment.pr_from_workflow_run",
+                autospec=True,
+            ) as from_workflow_run,
         ):
             instance = await Commenter.from_event(
                 Mock(), "workflow_run", self.event_file
             )
         assert instance.pr == "PR_node_id"
+        # the cheap REST lookup found the PR, no need for the GraphQL search
+        from_workflow_run.assert_not_called()
 
     async def test_from_workflow_run_from_head_branch(self) -> None:
         with (
@@ -236,6 +365,11 @@ class TestCommenterFromEvent:
                     repository=Mock(node_id="R_node_id"),
                 ),
             ),
+            patch(
+                "pyright_analysis_action.comment.pr_from_commit",
+                autospec=True,
+                return_value=None,
+            ) as from_commit,
             patch(
                 "pyright_analysis_action.comment.pr_from_workflow_run",
                 autospec=True,
@@ -246,6 +380,72 @@ class TestCommenterFromEvent:
                 Mock(), "workflow_run", self.event_file
             )
         assert instance.pr == "PR_node_id"
+        from_commit.assert_called_once()
+
+
+def _commit_pr(
+    pr_id: str, head_ref: str, repo_id: str | None, sha: str = "head_sha"
+) -> Mock:
+    repo = None if repo_id is None else Mock(node_id=repo_id)
+    return Mock(node_id=pr_id, head=Mock(ref=head_ref, repo=repo, sha=sha))
+
+
+class TestPrFromCommit:
+    @staticmethod
+    def _client(*prs: Mock) -> Mock:
+        client = Mock()
+        client.rest.repos.async_list_pull_requests_associated_with_commit = AsyncMock(
+            return_value=Mock(parsed_data=list(prs))
+        )
+        return client
+
+    async def _lookup(self, client: Mock) -> str | None:
+        return await pr_from_commit(
+            client, "owner", "repo", "R_head_repository", "some_branch", "head_sha"
+        )
+
+    async def test_single_match(self) -> None:
+        client = self._client(
+            _commit_pr("PR_other_branch", "other_branch", "R_head_repository"),
+            _commit_pr("PR_other_repo", "some_branch", "R_other_repository"),
+            _commit_pr("PR_deleted_repo", "some_branch", None),
+            _commit_pr("PR_target", "some_branch", "R_head_repository"),
+        )
+        assert await self._lookup(client) == "PR_target"
+        lookup = client.rest.repos.async_list_pull_requests_associated_with_commit
+        lookup.assert_awaited_once_with("owner", "repo", "head_sha")
+
+    async def test_no_matches(self) -> None:
+        client = self._client(
+            _commit_pr("PR_other_branch", "other_branch", "R_head_repository")
+        )
+        assert await self._lookup(client) is None
+
+    async def test_multiple_matches(self) -> None:
+        client = self._client(
+            _commit_pr("PR_older", "some_branch", "R_head_repository", "old_sha"),
+            _commit_pr("PR_target", "some_branch", "R_head_repository"),
+        )
+        assert await self._lookup(client) == "PR_target"
+
+    async def test_ambiguous(self) -> None:
+        client = self._client(
+            _commit_pr("PR_one", "some_branch", "R_head_repository"),
+            _commit_pr("PR_two", "some_branch", "R_head_repository"),
+        )
+        assert await self._lookup(client) is None
+
+    @pytest.mark.parametrize(
+        "exception",
+        (RequestFailed(Mock(status_code=404)), RequestTimeout(Mock())),
+        ids=("failed", "timeout"),
+    )
+    async def test_request_failed(self, exception: GitHubException) -> None:
+        client = Mock()
+        client.rest.repos.async_list_pull_requests_associated_with_commit = AsyncMock(
+            side_effect=exception
+        )
+        assert await self._lookup(client) is None
 
 
 def test_comment_marker():
@@ -253,101 +453,264 @@ def test_comment_marker():
     assert commenter.comment_marker == "<!-- pyright-analysis-action foo='bar' -->"
 
 
+def _comments_api(
+    comments: list[dict[str, Any]], request: httpx.Request
+) -> httpx.Response:
+    """Serve PR comments the way the GitHub GraphQL API does
+
+    Pages of comments are listed without their bodies, which are served by
+    node id instead. A comment with a `None` body was deleted after it was
+    listed, and is served as a null node.
+    """
+    payload = json.loads(request.content)
+    variables = payload["variables"]
+    if "ids" in variables:
+        by_id = {cmt["id"]: cmt for cmt in comments}
+        nodes = [
+            None if (body := by_id[id]["body"]) is None else {"id": id, "body": body}
+            for id in variables["ids"]
+        ]
+        return httpx.Response(200, json={"data": {"nodes": nodes}})
+    cursor = variables.get("cursor")
+    if "last: 100" in payload["query"]:
+        end = len(comments) if cursor is None else int(cursor)
+        start = max(end - 100, 0)
+        page_info: dict[str, Any] = {
+            "startCursor": str(start),
+            "hasPreviousPage": start > 0,
+        }
+    else:
+        start = 0 if cursor is None else int(cursor)
+        end = min(start + 100, len(comments))
+        page_info = {"endCursor": str(end), "hasNextPage": end < len(comments)}
+    nodes = [
+        {key: value for key, value in cmt.items() if key != "body"}
+        for cmt in comments[start:end]
+    ]
+    page = {"nodes": nodes, "pageInfo": page_info}
+    return httpx.Response(200, json={"data": {"node": {"comments": page}}})
+
+
 class TestExistingComment:
     async def test_none_matching(
         self, github: GitHub[Any], graphql_mock: Route
     ) -> None:
         commenter = Commenter(github, "PR_node_id", worflow="mock_flow")
-        graphql_mock.respond(
-            json={
-                "data": {
-                    "node": {
-                        "comments": {
-                            "nodes": [
-                                {
-                                    "id": "IC_comment1",
-                                    "isMinimized": True,
-                                    "viewerDidAuthor": True,
-                                    "body": "First comment\n\n"
-                                    + commenter.comment_marker,
-                                },
-                                {
-                                    "id": "IC_comment2",
-                                    "isMinimized": False,
-                                    "viewerDidAuthor": False,
-                                    "body": "Second comment",
-                                },
-                                {
-                                    "id": "IC_comment3",
-                                    "isMinimized": False,
-                                    "viewerDidAuthor": True,
-                                    "body": "Third comment",
-                                },
-                                {
-                                    "id": "IC_comment4",
-                                    "isMinimized": False,
-                                    "viewerDidAuthor": True,
-                                    "body": "Last comment\n\n"
-                                    + commenter.comment_marker.replace("mock", "spam"),
-                                },
-                            ],
-                            "pageInfo": {"endCursor": "Opaque", "hasNextPage": False},
-                        }
-                    }
-                }
-            }
-        )
+        comments = [
+            {
+                "id": "IC_comment1",
+                "isMinimized": True,
+                "viewerDidAuthor": True,
+                "body": "First comment\n\n" + commenter.comment_marker,
+            },
+            {
+                "id": "IC_comment2",
+                "isMinimized": False,
+                "viewerDidAuthor": False,
+                "body": "Second comment",
+            },
+            {
+                "id": "IC_comment3",
+                "isMinimized": False,
+                "viewerDidAuthor": True,
+                "body": "Third comment",
+            },
+            {
+                "id": "IC_comment4",
+                "isMinimized": False,
+                "viewerDidAuthor": True,
+                "body": "Last comment\n\n"
+                + commenter.comment_marker.replace("mock", "spam"),
+            },
+        ]
+        graphql_mock.side_effect = partial(_comments_api, comments)
         assert await commenter.existing_comment_id() is None
+        # only the bodies of our own, visible comments are fetched
+        req = graphql_mock.calls.last.request
+        assert json.loads(req.content)["variables"] == {
+            "ids": ["IC_comment3", "IC_comment4"]
+        }
 
     async def test_matching(self, github: GitHub[Any], graphql_mock: Route) -> None:
         commenter = Commenter(github, "PR_node_id", workflow="mock_flow")
-        graphql_mock.respond(
-            json={
-                "data": {
-                    "node": {
-                        "comments": {
-                            "nodes": [
-                                {
-                                    "id": "IC_node_id",
-                                    "isMinimized": False,
-                                    "viewerDidAuthor": True,
-                                    "body": "First comment\n\n"
-                                    + commenter.comment_marker,
-                                },
-                            ],
-                            "pageInfo": {"endCursor": "Opaque", "hasNextPage": False},
-                        }
-                    }
-                }
+        comments = [
+            {
+                "id": "IC_node_id",
+                "isMinimized": False,
+                "viewerDidAuthor": True,
+                "body": "First comment\n\n" + commenter.comment_marker,
+            },
+        ]
+        graphql_mock.side_effect = partial(_comments_api, comments)
+        assert await commenter.existing_comment_id() == "IC_node_id"
+        assert graphql_mock.call_count == 2
+
+    async def test_deleted(self, github: GitHub[Any], graphql_mock: Route) -> None:
+        commenter = Commenter(github, "PR_node_id", workflow="mock_flow")
+        comments = [
+            {
+                "id": f"IC_{name}",
+                "isMinimized": False,
+                "viewerDidAuthor": True,
+                "body": body,
             }
-        )
+            for name, body in (
+                ("deleted", None),
+                ("node_id", "First comment\n\n" + commenter.comment_marker),
+            )
+        ]
+        graphql_mock.side_effect = partial(_comments_api, comments)
+        assert await commenter.existing_comment_id() == "IC_node_id"
+
+    async def test_no_candidates(
+        self, github: GitHub[Any], graphql_mock: Route
+    ) -> None:
+        commenter = Commenter(github, "PR_node_id", workflow="mock_flow")
+        comments = [
+            {
+                "id": "IC_node_id",
+                "isMinimized": False,
+                "viewerDidAuthor": False,
+                "body": "Some other comment",
+            },
+        ]
+        graphql_mock.side_effect = partial(_comments_api, comments)
+        assert await commenter.existing_comment_id() is None
+        # no bodies to fetch
+        assert graphql_mock.call_count == 1
+
+    async def test_continues_after_first_page(
+        self, github: GitHub[Any], graphql_mock: Route
+    ) -> None:
+        first_page: Any = {
+            "nodes": [
+                {"id": "IC_other", "isMinimized": False, "viewerDidAuthor": False}
+            ],
+            "pageInfo": {"endCursor": "1", "hasNextPage": True},
+        }
+        commenter = Commenter(github, "PR_node_id", first_page, workflow="mock_flow")
+        comments = [
+            {
+                "id": "IC_other",
+                "isMinimized": False,
+                "viewerDidAuthor": False,
+                "body": "Some other comment",
+            },
+            {
+                "id": "IC_node_id",
+                "isMinimized": False,
+                "viewerDidAuthor": True,
+                "body": "Comment\n\n" + commenter.comment_marker,
+            },
+        ]
+        graphql_mock.side_effect = partial(_comments_api, comments)
         assert await commenter.existing_comment_id() == "IC_node_id"
+        req = graphql_mock.calls[0].request
+        assert json.loads(req.content)["variables"] == {
+            "pr_id": "PR_node_id",
+            "cursor": "1",
+        }
+
+
+@pytest.mark.parametrize(
+    "order,expected_requests",
+    ((CommentOrder.oldest_first, 51), (CommentOrder.newest_first, 2)),
+)
+async def test_existing_comment_on_long_pr(
+    github: GitHub[Any],
+    graphql_mock: Route,
+    order: CommentOrder,
+    expected_requests: int,
+) -> None:
+    # A long-lived PR with 5,000 comments, with ours near the end. Besides the
+    # pages of comments, one request fetches the body of our comment.
+    commenter = Commenter(github, "PR_node_id", order=order, workflow="mock_flow")
+    comments = [
+        {
+            "id": f"IC_{index}",
+            "isMinimized": False,
+            "viewerDidAuthor": False,
+            "body": "Some bot comment " * 100,
+        }
+        for index in range(5000)
+    ]
+    comments[4990] |= {"viewerDidAuthor": True, "body": commenter.comment_marker}
+    graphql_mock.side_effect = partial(_comments_api, comments)
+
+    assert await commenter.existing_comment_id() == "IC_4990"
+    assert graphql_mock.call_count == expected_requests
 
 
 class TestCommenterPost:
     async def test_existing(self):
         commenter = Commenter(Mock(), "PR_node_id", foo="bar")
-        with (
-            patch.object(
-                commenter,
-                "existing_comment_id",
-                autospec=True,
-                return_value="IC_node_id",
-            ),
-            patch.object(
-                commenter, "_update_comment", new=AsyncMock(return_value="return_value")
-            ),
-        ):
-            assert await commenter.post_or_update_comment("summary") == "return_value"
+        update_comment = AsyncMock(return_value="return_value")
+        with patch.object(commenter, "_update_comment", new=update_comment):
+            result = await commenter.post_or_update_comment("summary", "IC_node_id")
+        assert result == "return_value"
+        assert update_comment.await_args is not None
+        assert update_comment.await_args.args[0]["id"] == "IC_node_id"
 
     async def test_new(self):
         commenter = Commenter(Mock(), "PR_node_id", foo="bar")
-        with (
-            patch.object(
-                commenter, "existing_comment_id", autospec=True, return_value=None
-            ),
-            patch.object(
-                commenter, "_add_comment", new=AsyncMock(return_value="return_value")
-            ),
+        with patch.object(
+            commenter, "_add_comment", new=AsyncMock(return_value="return_value")
         ):
-            assert await commenter.post_or_update_comment("summary") == "return_value"
+            assert await commenter.post_or_update_comment("summary", None) == (
+                "return_value"
+            )
+
+    async def test_records_site(self):
+        commenter = Commenter(Mock(), "PR_node_id", foo="bar")
+        site = PublishedSite(
+            content_hash="abc123",
+            html_url="https://example.com/foobar/",
+            expiration=datetime.now(UTC),
+            pages=[
+                PublishedPage(
+                    package_name="foobar",
+                    html_url="https://example.com/foobar/",
+                    preview_url="https://example.com/foobar/preview.svg",
+                )
+            ],
+        )
+        add_comment = AsyncMock(return_value="return_value")
+        with patch.object(commenter, "_add_comment", new=add_comment):
+            await commenter.post_or_update_comment("summary", None, site)
+        assert add_comment.await_args is not None
+        body = add_comment.await_args.args[0]["body"]
+        assert commenter.comment_marker in body
+        assert PublishedSite.from_comment(body) == site
+
+
+class TestPublishedSite:
+    def site(self, **changes: Any) -> PublishedSite:
+        return PublishedSite(
+            content_hash="abc123",
+            html_url="https://example.com/foobar/",
+            expiration=datetime.now(UTC) + timedelta(days=2),
+            pages=[
+                PublishedPage(
+                    package_name="foobar",
+                    html_url="https://example.com/foobar/",
+                    preview_url="https://example.com/foobar/preview.svg",
+                )
+            ],
+        ).model_copy(update=changes)
+
+    def test_from_comment(self) -> None:
+        site = self.site()
+        assert PublishedSite.from_comment(f"summary\n{site.marker}\n") == site
+        assert PublishedSite.from_comment("summary") is None
+        marker = "<!-- pyright-analysis-action-site {} -->"
+        assert PublishedSite.from_comment(marker) is None
+
+    def test_reusable(self) -> None:
+        assert self.site().reusable("abc123")
+        assert not self.site().reusable("def456")
+        expired = self.site(expiration=datetime.now(UTC) - timedelta(seconds=1))
+        assert not expired.reusable("abc123")
+        expiring = self.site(expiration=datetime.now(UTC) + timedelta(hours=23))
+        assert not expiring.reusable("abc123")
+        assert self.site(expiration=None).reusable("abc123")
+        assert not self.site(expiration=None).reusable("def456")
@@ -10,6 +10,7 @@ from githubkit import GitHub
 from graphql import (
     GraphQLSchema,
     InputObjectTypeDefinitionNode,
+    ListTypeNode,
     NamedTypeNode,
     NameNode,
     NonNullTypeNode,
@@ -21,11 +22,14 @@ from graphql import (
 from respx import Route
 
 from pyright_analysis_action._graphql import (
+    CommentsPageForPrNumberQuery,
+    GQLBatch,
     GQLMutation,
     GQLPagedQuery,
     GQLQuery,
     GQLQueryBase,
     JSONAny,
+    PullRequestIdQuery,
     _unwrap_singles,
 )
 
@@ -117,7 +121,16 @@ def test_validate_variables(
 
     handled: set[str] = set()
     for name, var_type in vdefs:
+        is_list = False
         match var_type:
+            case NonNullTypeNode(
+                type=ListTypeNode(
+                    type=NonNullTypeNode(
+                        type=NamedTypeNode(name=NameNode(value=type_name))
+                    )
+                )
+            ):
+                nullable, is_list = False, True
             case NonNullTypeNode(type=NamedTypeNode(name=NameNode(value=type_name))):
                 nullable = False
             case NamedTypeNode(name=NameNode(value=type_name)):
@@ -135,6 +148,8 @@ def test_validate_variables(
             case _:
                 raise AssertionError(f"Don't know how to validate {type_name}")
 
+        if is_list:
+            expected_type = list[expected_type]
         if nullable:
             if name not in variable_types:
                 continue
@@ -193,3 +208,52 @@ async def test_qglmuttion(github: GitHub[Any], graphql_mock: Route) -> None:
     assert result == 42
     req = graphql_mock.calls.last.request
     assert json.loads(req.content)["variables"] == {"input": {"foo": "bar"}}
+
+
+async def test_gqlbatch(
+    github: GitHub[Any], graphql_mock: Route, github_graphql_schema: GraphQLSchema
+) -> None:
+    batch = GQLBatch(github)
+    pr_id = batch.add(
+        PullRequestIdQuery(github), {"repository_id": "R_repo", "number": 42}
+    )
+    comments = batch.add(
+        CommentsPageForPrNumberQuery(github), {"repository_id": "R_repo", "number": 42}
+    )
+    document, variables = batch.document()
+    assert not validate(github_graphql_schema, parse(document))
+    assert variables == {
+        "q0_repository_id": "R_repo",
+        "q0_number": 42,
+        "q1_repository_id": "R_repo",
+        "q1_number": 42,
+    }
+
+    page = {
+        "nodes": [],
+        "pageInfo": {"endCursor": None, "hasNextPage": False},
+    }
+    graphql_mock.respond(
+        json={
+            "data": {
+                "q0": {"pullRequest": {"id": "PR_node_id"}},
+                "q1": {"pullRequest": {"comments": page}},
+            }
+        }
+    )
+    await batch.execute()
+    assert graphql_mock.call_count == 1
+    req = graphql_mock.calls.last.request
+    assert json.loads(req.content)["variables"] == variables
+    assert pr_id.result() == "PR_node_id"
+    assert comments.result() == page
+
+
+async def test_gqlbatch_unbatchable(github: GitHub[Any]) -> None:
+    class TestMutation(GQLQuery[Any, Any]):
+        _query = """mutation TestMutation() {}"""
+
+    batch = GQLBatch(github)
+    batch.add(TestMutation(github), {})
+    with pytest.raises(ValueError):
+        batch.document()
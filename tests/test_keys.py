@@ -0,0 +1,34 @@
+from pathlib import Path
+from unittest.mock import patch
+
+from typer.testing import CliRunner
+
+from pyright_analysis_action.cli import cli
+from pyright_analysis_action.smokeshow import SmokeshowKeyPool
+
+runner = CliRunner()
+
+
+def test_mine(tmp_path: Path) -> None:
+    pool_path = tmp_path / "keys.txt"
+    SmokeshowKeyPool(pool_path).add(["existing-key"])
+    with patch(
+        "pyright_analysis_action.keys.generate_smokeshow_key",
+        autospec=True,
+        side_effect=["mined-key-1", "mined-key-2"],
+    ) as mock_generate_key:
+        result = runner.invoke(
+            cli, ["keys", "mine", "--count", "2", "--workers", "3", str(pool_path)]
+        )
+    assert result.exit_code == 0, result.output
+    mock_generate_key.assert_called_with(3)
+    assert pool_path.read_text() == "existing-key\nmined-key-1\nmined-key-2\n"
+    assert "holds 3 keys" in result.output
+
+
+def test_count(tmp_path: Path) -> None:
+    pool_path = tmp_path / "keys.txt"
+    SmokeshowKeyPool(pool_path).add(["key-1", "key-2"])
+    result = runner.invoke(cli, ["keys", "count", str(pool_path)])
+    assert result.exit_code == 0, result.output
+    assert result.output.strip() == "2"
@@ -0,0 +1,134 @@
+import asyncio
+import datetime
+import threading
+import urllib.request
+from collections.abc import Iterator
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from unittest.mock import patch
+
+import pytest
+from yarl import URL
+
+from pyright_analysis_action.publish import (
+    LocalSite,
+    Minified,
+    iter_chunks,
+    page_url,
+    upload,
+    utf8_size,
+)
+
+
+class _QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, format: str, *args: object) -> None:
+        pass
+
+
+@pytest.fixture
+def http_server(tmp_path: Path) -> Iterator[tuple[Path, str]]:
+    """A local stand-in for a hosted site, serving files from a directory"""
+    directory = tmp_path / "www"
+    directory.mkdir()
+    handler = partial(_QuietHandler, directory=str(directory))
+    with ThreadingHTTPServer(("127.0.0.1", 0), handler) as server:
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        try:
+            yield directory, f"http://127.0.0.1:{server.server_port}/"
+        finally:
+            server.shutdown()
+            thread.join()
+
+
+def test_iter_chunks(tmp_path: Path) -> None:
+    text = "é" * 3 + "x" * 5
+    path = tmp_path / "page.html"
+    path.write_text(text)
+    with patch("pyright_analysis_action.publish.CHUNK_SIZE", 4):
+        assert list(iter_chunks(text)) == [b"\xc3\xa9" * 3 + b"x", b"xxxx"]
+        assert list(iter_chunks(path)) == [b"\xc3\xa9\xc3\xa9", b"\xc3\xa9xx", b"xxx"]
+        assert utf8_size(text) == len(text.encode()) == 11
+    assert utf8_size("ascii only") == 10
+
+
+@pytest.mark.parametrize(
+    "url,expected",
+    (
+        ("https://example.com/site/index.html", "https://example.com/site"),
+        (
+            "https://example.com/site/preview.svg",
+            "https://example.com/site/preview.svg",
+        ),
+        ("file:///tmp/site/index.html", "file:///tmp/site/index.html"),
+    ),
+)
+def test_page_url(url: str, expected: str) -> None:
+    assert page_url(URL(url)) == URL(expected)
+
+
+class TestLocalSite:
+    def test_upload(self, tmp_path: Path) -> None:
+        directory = tmp_path / "site"
+        preview = tmp_path / "preview.svg"
+        preview.write_bytes(b"<svg/>")
+
+        async def publish() -> tuple[datetime.datetime | None, URL, URL]:
+            async with LocalSite(directory) as site:
+                return await upload(site, "<html>ü</html>", b"<svg/>", prefix="pkg/")
+
+        expiration, html_url, preview_url = asyncio.run(publish())
+        assert expiration is None
+        assert (directory / "pkg/index.html").read_text() == "<html>ü</html>"
+        assert (directory / "pkg/preview.svg").read_bytes() == b"<svg/>"
+        assert html_url == URL((directory / "pkg/index.html").resolve().as_uri())
+        assert preview_url == URL((directory / "pkg/preview.svg").resolve().as_uri())
+
+    def test_upload_file(self, tmp_path: Path) -> None:
+        source = tmp_path / "source.html"
+        source.write_text("<html/>")
+
+        async def publish() -> URL:
+            async with LocalSite(tmp_path / "site") as site:
+                return await site.upload("index.html", source, "text/html")
+
+        asyncio.run(publish())
+        assert (tmp_path / "site/index.html").read_text() == "<html/>"
+
+    def test_upload_minified(
+        self, tmp_path: Path, capsys: pytest.CaptureFixture[str]
+    ) -> None:
+        async def publish() -> tuple[datetime.datetime | None, URL, URL]:
+            async with LocalSite(tmp_path / "site") as site:
+                return await upload(site, Minified("<html/>", 2048), b"<svg/>")
+
+        asyncio.run(publish())
+        assert (tmp_path / "site/index.html").read_text() == "<html/>"
+        assert "Wrote index.html (text/html, 7 Bytes, saved 2.0 KiB)" in (
+            capsys.readouterr().out
+        )
+
+    @pytest.mark.parametrize("name", ("../index.html", "pkg/../../index.html"))
+    def test_upload_outside_directory(self, tmp_path: Path, name: str) -> None:
+        async def publish() -> URL:
+            async with LocalSite(tmp_path / "site") as site:
+                return await site.upload(name, "<html/>", "text/html")
+
+        with pytest.raises(ValueError):
+            asyncio.run(publish())
+        assert not (tmp_path / "index.html").exists()
+
+    def test_served(self, http_server: tuple[Path, str]) -> None:
+        directory, base_url = http_server
+
+        async def publish() -> tuple[datetime.datetime | None, URL, URL]:
+            async with LocalSite(directory, base_url) as site:
+                return await upload(site, "<html/>", b"<svg/>", prefix="pkg/")
+
+        _, html_url, preview_url = asyncio.run(publish())
+        assert html_url == URL(base_url) / "pkg"
+        with urllib.request.urlopen(str(preview_url)) as response:
+            assert response.read() == b"<svg/>"
+        with urllib.request.urlopen(f"{html_url}/") as response:
+            assert response.read() == b"<html/>"
@@ -0,0 +1,169 @@
+import base64
+from array import array
+from collections.abc import Iterator
+from typing import Any
+from unittest.mock import MagicMock, patch
+
+import plotly.graph_objects as go  # pyright: ignore[reportMissingTypeStubs]
+import pytest
+
+from pyright_analysis_action._render import (
+    FigureEncoding,
+    ImageRenderer,
+    _json_size,
+    _typed_array,
+    compact_figure,
+    encode_figure,
+    minify_figure,
+)
+
+
+@pytest.fixture
+def mock_kaleido() -> Iterator[MagicMock]:
+    with patch("kaleido.Kaleido", autospec=True) as mock_kaleido:
+        mock_kaleido.return_value.calc_fig.return_value = b"<svg/>"
+        yield mock_kaleido
+
+
+async def test_renderer_reuses_browser(mock_kaleido: MagicMock) -> None:
+    figure = go.Figure(go.Treemap(labels=["foo"], parents=[""]))
+    async with ImageRenderer(tabs=2) as renderer:
+        assert await renderer.to_image(figure) == b"<svg/>"
+        assert await renderer.to_image(figure, "png", scale=0.5) == b"<svg/>"
+
+    mock_kaleido.assert_called_once_with(n=2)
+    browser = mock_kaleido.return_value
+    browser.open.assert_awaited_once()
+    browser.close.assert_awaited_once()
+    size = {"width": 700, "height": 500}
+    assert [call.kwargs["opts"] for call in browser.calc_fig.await_args_list] == [
+        {"format": "svg", **size, "scale": 1},
+        {"format": "png", **size, "scale": 0.5},
+    ]
+    assert browser.calc_fig.await_args.args[0] == figure.to_dict()
+
+
+@pytest.mark.parametrize(
+    ("layout", "expected"),
+    (
+        ({"width": 1200, "height": 800}, (1200, 800)),
+        ({"template": {"layout": {"width": 1000}}}, (1000, 500)),
+        ({"height": 300, "template": {"layout": {"height": 900}}}, (700, 300)),
+    ),
+)
+async def test_renderer_figure_size(
+    mock_kaleido: MagicMock, layout: dict[str, Any], expected: tuple[int, int]
+) -> None:
+    figure = go.Figure(go.Treemap(labels=["foo"], parents=[""]), layout=layout)
+    async with ImageRenderer() as renderer:
+        await renderer.to_image(figure)
+    opts = mock_kaleido.return_value.calc_fig.await_args.kwargs["opts"]
+    assert (opts["width"], opts["height"]) == expected
+
+
+async def test_renderer_closed(mock_kaleido: MagicMock) -> None:
+    renderer = ImageRenderer()
+    async with renderer:
+        pass
+    with pytest.raises(AssertionError):
+        await renderer.to_image(go.Figure())
+
+
+def test_minify_figure() -> None:
+    template = {"data": {"treemap": [{"opacity": 0.5}], "bar": [{"opacity": 0.5}]}}
+    figure = go.Figure(
+        go.Treemap(labels=["foo"], parents=[""]),
+        layout={"template": template, "title": {"text": "Foo"}},
+    )
+    spec = minify_figure(figure)
+    assert list(spec["layout"]["template"]["data"]) == ["treemap"]
+    expected = figure.to_dict()
+    del expected["layout"]["template"]
+    del spec["layout"]["template"]
+    assert spec == expected
+
+
+def test_compact_figure() -> None:
+    # a chain of nested modules, each the parent of the next
+    names = ["foo", *(f"foo.module{i}" for i in range(100))]
+    figure = go.Figure(
+        go.Treemap(
+            labels=names,
+            parents=["", *names[:-1]],
+            values=list(range(1000, 1101)),
+            customdata=[(i / 7, i, i, 0, 0) for i in range(101)],
+            marker={"colors": [i / 7 for i in range(101)]},
+        )
+    )
+    trace = compact_figure(figure)["data"][0]
+    assert trace["labels"] == names
+    # the parents reference short ids rather than repeating the labels
+    assert trace["ids"][:2] == ["0", "1"] and trace["ids"][-1] == "2s"
+    assert trace["parents"] == ["", *trace["ids"][:-1]]
+    assert trace["values"]["dtype"] == "i2"
+    decoded = array("h", base64.b64decode(trace["values"]["bdata"]))
+    assert decoded.tolist() == list(range(1000, 1101))
+    assert trace["marker"]["colors"]["dtype"] == "f8"
+    # rows of mostly small integers are shorter as JSON
+    assert trace["customdata"] == [[i / 7, i, i, 0, 0] for i in range(101)]
+
+
+@pytest.mark.parametrize(
+    "values,dtype",
+    (
+        ([-100, 100] * 50, "i1"),
+        ([0, 200] * 50, "u1"),
+        ([-1000, 1000] * 50, "i2"),
+        ([0, 60000] * 50, "u2"),
+        ([-1 << 20, 1 << 20] * 50, "i4"),
+        ([0, 1 << 31] * 50, "u4"),
+        ([i / 1024 for i in range(100)], "f4"),
+        ([i / 7 for i in range(100)], "f8"),
+    ),
+)
+def test_typed_array_dtype(values: list[float], dtype: str) -> None:
+    typed = _typed_array(values)
+    assert typed is not None
+    spec, saved = typed
+    assert spec["dtype"] == dtype
+    assert saved == _json_size(values) - _json_size(spec)
+
+
+@pytest.mark.parametrize("encoding", FigureEncoding)
+def test_encode_figure_saving(encoding: FigureEncoding) -> None:
+    names = ["foo", *(f"foo.module{i}" for i in range(100))]
+    figure = go.Figure(
+        go.Treemap(
+            labels=names,
+            parents=["", *names[:-1]],
+            values=list(range(1000, 1101)),
+        ),
+        layout={"template": "plotly"},
+    )
+    spec, saved = encode_figure(figure, encoding)
+    assert saved == _json_size(figure.to_dict()) - _json_size(spec)
+    assert (saved > 0) is (encoding is not FigureEncoding.json)
+
+
+def test_compact_figure_keeps_ids() -> None:
+    figure = go.Figure(
+        go.Treemap(ids=["a", "b"], labels=["a", "b"], parents=["", "missing"])
+    )
+    trace = compact_figure(figure)["data"][0]
+    assert (trace["ids"], trace["parents"]) == (["a", "b"], ["", "missing"])
+
+
+@pytest.mark.parametrize(
+    "values",
+    (
+        [],
+        ["foo"],
+        [True, False],
+        [-1.5, "foo"],
+        [(1, 2), (3,)],
+        [1 << 40] * 10,
+        [3, 1],  # shorter as JSON
+    ),
+)
+def test_typed_array_unsupported(values: list[Any]) -> None:
+    assert _typed_array(values) is None
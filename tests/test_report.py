@@ -0,0 +1,154 @@
+import json
+from pathlib import Path
+from typing import Any
+from unittest.mock import patch
+
+import pytest
+from pyright_analysis import schema, treemap
+
+from pyright_analysis_action._report import (
+    _JSONStream,
+    _ModuleTallies,
+    load_report,
+    to_treemap,
+)
+
+
+@pytest.fixture(params=(1, 7, 1 << 20), ids=("1", "7", "1M"))
+def chunk_size(request: pytest.FixtureRequest) -> Any:
+    with patch("pyright_analysis_action._report.CHUNK_SIZE", new=request.param):
+        yield request.param
+
+
+def _walk(stream: _JSONStream) -> Any:
+    match stream._peek():
+        case "{":
+            return {key: _walk(stream) for key in stream.object_keys()}
+        case "[":
+            return [_walk(stream) for _ in stream.array_items()]
+        case _:
+            return stream.value()
+
+
+@pytest.mark.usefixtures("chunk_size")
+class TestJSONStream:
+    @pytest.mark.parametrize(
+        "document",
+        (
+            '{"foo": [1, 2.5, "three", {"four": null}], "bar": {}, "baz": []}',
+            '  {\n  "foo" : [ 1 ,2.5,"three" , {"four":null}] ,"bar":{},"baz":[ ] } \n',
+            "12345678",
+        ),
+    )
+    def test_walk(self, document: str) -> None:
+        stream = _JSONStream(memoryview(document.encode()))
+        result = _walk(stream)
+        stream.end()
+        assert result == json.loads(document)
+
+    @pytest.mark.parametrize(
+        "document",
+        (
+            '{"foo": [1, 2',
+            '{"foo": "unterminated',
+            '{"foo" 1}',
+            '{"foo": 1] ',
+            '{"foo": 1} 42',
+            "{42: 1}",
+            "[1 2]",
+        ),
+    )
+    def test_invalid(self, document: str) -> None:
+        stream = _JSONStream(memoryview(document.encode()))
+        with pytest.raises(json.JSONDecodeError):
+            _walk(stream)
+            stream.end()
+
+
+def _expected_modules(report: str) -> dict[schema.SymbolName, treemap.ModuleInfo]:
+    results = schema.PyrightJsonResults.model_validate_json(report)
+    return treemap._collate(results.type_completeness)  # pyright: ignore[reportPrivateUsage]
+
+
+@pytest.fixture
+def report_path(tmp_path: Path, pyright_json_report: str) -> Path:
+    path = tmp_path / "report.json"
+    path.write_text(pyright_json_report)
+    return path
+
+
+@pytest.mark.usefixtures("chunk_size")
+def test_load_report(report_path: Path, pyright_json_report: str) -> None:
+    summary = load_report(report_path)
+    assert summary.package_name == "foobar"
+    assert summary.results.type_completeness.symbols == []
+    assert summary.modules == _expected_modules(pyright_json_report)
+
+
+def test_load_report_multibyte(tmp_path: Path, pyright_json_report: str) -> None:
+    # a non-ASCII character split across chunks must be decoded correctly
+    path = tmp_path / "report.json"
+    path.write_text(pyright_json_report.replace("MontyPython", "MøntyPythön"))
+    with patch("pyright_analysis_action._report.CHUNK_SIZE", new=1):
+        summary = load_report(path)
+    assert summary.modules == _expected_modules(pyright_json_report)
+
+
+def test_load_report_empty(tmp_path: Path) -> None:
+    path = tmp_path / "report.json"
+    path.touch()
+    with pytest.raises(json.JSONDecodeError):
+        load_report(path)
+
+
+def test_load_report_symbols_before_modules(
+    tmp_path: Path, pyright_json_report: str
+) -> None:
+    data = json.loads(pyright_json_report)
+    type_completeness = data["typeCompleteness"]
+    type_completeness["modules"] = type_completeness.pop("modules")
+    path = tmp_path / "report.json"
+    path.write_text(json.dumps(data))
+    summary = load_report(path)
+    assert summary.modules == _expected_modules(pyright_json_report)
+
+
+def test_load_report_flags(tmp_path: Path, pyright_json_report: str) -> None:
+    data = json.loads(pyright_json_report)
+    symbols = data["typeCompleteness"]["symbols"]
+    symbols[0] |= {"isTypeKnown": True, "isTypeAmbiguous": True}
+    symbols[1] |= {"isTypeKnown": False, "isTypeAmbiguous": True}
+    # not part of any module in the package, so not counted
+    symbols.append(symbols[0] | {"name": "elsewhere.ham"})
+    report = json.dumps(data)
+    path = tmp_path / "report.json"
+    path.write_text(report)
+    summary = load_report(path)
+    data["typeCompleteness"]["symbols"].pop()
+    assert summary.modules == _expected_modules(json.dumps(data))
+
+
+def test_module_tallies() -> None:
+    tallies = _ModuleTallies()
+    tallies.modules = {"pkg", "pkg.sub"}
+    for i in range(100):
+        tallies.add(
+            {
+                "name": f"pkg.sub.Class{i}.method",
+                "isExported": True,
+                "isTypeKnown": bool(i % 2),
+                "isTypeAmbiguous": False,
+            }
+        )
+    # one tally per module, however many symbols were counted
+    assert list(tallies._tallies) == ["pkg.sub"]
+    modules = tallies.collate()
+    assert modules[schema.SymbolName("pkg.sub")][1:] == (100, 50, 0, 50)
+    assert modules[schema.SymbolName("pkg")][1:] == (100, 50, 0, 50)
+
+
+def test_to_treemap(report_path: Path, pyright_json_report: str) -> None:
+    results = schema.PyrightJsonResults.model_validate_json(pyright_json_report)
+    expected = treemap.to_treemap(results.type_completeness)
+    figure = to_treemap(load_report(report_path))
+    assert figure.to_plotly_json() == expected.to_plotly_json()
@@ -1,26 +1,41 @@
 import asyncio
+import base64
 import datetime
-from collections.abc import Iterator
+import threading
+from collections.abc import AsyncIterator, Callable, Iterator
+from hashlib import sha256
+from pathlib import Path
+from types import SimpleNamespace
 from typing import Protocol
-from unittest.mock import Mock, patch, seal
+from unittest.mock import ANY, Mock, patch, seal
 
 import pytest
 from aiohttp import (
     ClientConnectionError,
     ClientResponse,
+    ClientResponseError,
+    ClientTimeout,
     hdrs,
 )
 from aioresponses import aioresponses as AioResponses
 from yarl import URL
 
 from pyright_analysis_action import __version__
+from pyright_analysis_action.publish import Minified, upload
 from pyright_analysis_action.smokeshow import (
     SMOKESHOW_CREATE,
     USER_AGENT,
+    ConnectionSettings,
+    KeySearchStopped,
     SmokeshowCreateResponse,
+    SmokeshowKeyPool,
+    SmokeshowSite,
     SmokeshowUploadResponse,
+    UploadData,
+    UploadStats,
+    _request_body,
+    _timing_trace_config,
     generate_smokeshow_key,
-    upload,
 )
 
 _STREAM_WRITER = Mock(output_size=0)
@@ -74,13 +89,25 @@ def create_response(aioresponses: AioResponses, secret_key: str) -> None:
     aioresponses.post(SMOKESHOW_CREATE, status=200, body=response.model_dump_json())
 
 
+async def _upload(
+    key: str | None,
+    html_page: str | Minified,
+    preview_image: bytes,
+    key_pool: SmokeshowKeyPool | None = None,
+) -> tuple[datetime.datetime | None, URL, URL]:
+    async with SmokeshowSite(key, key_pool) as site:
+        return await upload(site, html_page, preview_image)
+
+
 class UploadResponseFactory(Protocol):
-    def __call__(self, path: str) -> None: ...
+    def __call__(
+        self, path: str, callback: Callable[..., None] | None = None
+    ) -> None: ...
 
 
 @pytest.fixture
 def upload_response_factory(aioresponses: AioResponses) -> UploadResponseFactory:
-    def upload_response(path: str) -> None:
+    def upload_response(path: str, callback: Callable[..., None] | None = None) -> None:
         response = SmokeshowUploadResponse(
             path=path,
             content_type="example/mock-type",
@@ -91,18 +118,102 @@ def upload_response_factory(aioresponses: AioResponses) -> UploadResponseFactory
             f"https://test.example.com/foobar/{path}",
             status=200,
             body=response.model_dump_json(),
+            callback=callback,
         )
 
     return upload_response
 
 
-@patch(
-    "pyright_analysis_action.smokeshow.HASH_PREFIXES",
-    new=tuple(bytes([0, 0, i]) for i in range(32)),
-)
-def test_generate_smokeshow_key() -> None:
-    result = generate_smokeshow_key()
+def test_upload_response_saved() -> None:
+    response = SmokeshowUploadResponse(
+        path="index.html", content_type="text/html", size=1024, total_site_size=2048
+    )
+    assert str(response) == "Uploaded index.html (text/html, 1.0 KiB, total 2.0 KiB)"
+    response = response.model_copy(update={"saved": 512})
+    assert str(response) == (
+        "Uploaded index.html (text/html, 1.0 KiB, saved 512 Bytes, total 2.0 KiB)"
+    )
+
+
+def test_connection_settings() -> None:
+    settings = ConnectionSettings(
+        limit=3, keepalive_timeout=5, dns_cache_ttl=60, connect_timeout=2
+    )
+
+    async def make_connector() -> tuple[int, bool, float | None]:
+        connector = settings.connector()
+        try:
+            return (
+                connector.limit,
+                connector.use_dns_cache,
+                connector._keepalive_timeout,
+            )
+        finally:
+            await connector.close()
+
+    assert asyncio.run(make_connector()) == (3, True, 5)
+    assert settings.timeout() == ClientTimeout(total=300, sock_connect=2, sock_read=60)
+
+
+@pytest.mark.parametrize("reused", (False, True))
+def test_timing_trace_config(reused: bool, caplog: pytest.LogCaptureFixture) -> None:
+    config = _timing_trace_config()
+    config.freeze()
+    session, ctx = Mock(), SimpleNamespace()
+    url = URL("https://test.example.com/foobar/index.html")
+
+    async def request() -> None:
+        await config.on_request_start.send(session, ctx, Mock())
+        if reused:
+            await config.on_connection_reuseconn.send(session, ctx, Mock())
+        else:
+            await config.on_connection_create_start.send(session, ctx, Mock())
+            await config.on_connection_create_end.send(session, ctx, Mock())
+        params = Mock(method="POST", url=url, response=Mock(status=200))
+        await config.on_request_end.send(session, ctx, params)
+
+    with caplog.at_level("DEBUG", logger="pyright_analysis_action.smokeshow"):
+        asyncio.run(request())
+
+    (message,) = caplog.messages
+    assert message.startswith(f"POST {url}: 200 in ")
+    assert (", reused" in message) is reused
+
+
+@patch("pyright_analysis_action.smokeshow.KEY_DIFFICULTY", new=19)
+@pytest.mark.parametrize("workers", (None, 1, 2))
+def test_generate_smokeshow_key(workers: int | None) -> None:
+    result = generate_smokeshow_key(workers)
     assert isinstance(result, str)
+    seed = base64.b64decode(result + "==")
+    assert len(seed) == 50
+    assert int.from_bytes(sha256(seed).digest()) >> (256 - 19) == 0
+
+
+@patch("pyright_analysis_action.smokeshow.KEY_DIFFICULTY", new=256)
+def test_generate_smokeshow_key_stopped() -> None:
+    stop = threading.Event()
+    stop.set()
+    with pytest.raises(KeySearchStopped):
+        generate_smokeshow_key(1, stop=stop)
+
+
+class TestSmokeshowKeyPool:
+    def test_missing_file(self, tmp_path: Path) -> None:
+        pool = SmokeshowKeyPool(tmp_path / "keys.txt")
+        assert len(pool) == 0
+        assert pool.pop() is None
+
+    def test_add_and_pop(self, tmp_path: Path) -> None:
+        pool = SmokeshowKeyPool(tmp_path / "keys.txt")
+        pool.add(["key-1", "key-2"])
+        pool.add(["key-3"])
+        assert len(pool) == 3
+        assert pool.pop() == "key-1"
+        assert (tmp_path / "keys.txt").read_text() == "key-2\nkey-3\n"
+        assert pool.pop() == "key-2"
+        assert pool.pop() == "key-3"
+        assert pool.pop() is None
 
 
 class TestSmokeshowUpload:
@@ -126,9 +237,9 @@ class TestSmokeshowUpload:
         self.mock_generate_key.return_value = "random-generated-test-key"
         upload_response_factory("index.html")
         upload_response_factory("preview.svg")
-        result = asyncio.run(upload(smokeshow_key, "<html/>", b"<svg/>"))
+        result = asyncio.run(_upload(smokeshow_key, "<html/>", b"<svg/>"))
         if not smokeshow_key:
-            self.mock_generate_key.assert_any_call()
+            self.mock_generate_key.assert_any_call(stop=ANY)
         else:
             assert not self.mock_generate_key.called
         expected_authorization = smokeshow_key or "random-generated-test-key"
@@ -158,6 +269,193 @@ class TestSmokeshowUpload:
         assert result[1] == URL("https://test.example.com/foobar")
         assert result[2] == URL("https://test.example.com/foobar/preview.svg")
 
+    @pytest.mark.usefixtures("create_response")
+    def test_upload_pooled_key(
+        self,
+        tmp_path: Path,
+        aioresponses: AioResponses,
+        upload_response_factory: UploadResponseFactory,
+    ) -> None:
+        pool = SmokeshowKeyPool(tmp_path / "keys.txt")
+        pool.add(["pooled-key", "spare-key"])
+        upload_response_factory("index.html")
+        upload_response_factory("preview.svg")
+        asyncio.run(_upload(None, "<html/>", b"<svg/>", key_pool=pool))
+        assert not self.mock_generate_key.called
+        base_headers = {"User-Agent": USER_AGENT.format(version=__version__)}
+        aioresponses.assert_called_with(
+            SMOKESHOW_CREATE,
+            hdrs.METH_POST,
+            headers=base_headers | {"Authorisation": "pooled-key"},
+        )
+        assert pool.pop() == "spare-key"
+
+    @pytest.mark.usefixtures("create_response")
+    def test_upload_when_ready(
+        self, upload_response_factory: UploadResponseFactory
+    ) -> None:
+        # the preview is uploaded while the HTML page is still being rendered
+        preview_uploaded = asyncio.Event()
+        upload_response_factory("index.html")
+        upload_response_factory(
+            "preview.svg", callback=lambda *args, **kwargs: preview_uploaded.set()
+        )
+
+        async def html_page() -> str:
+            await preview_uploaded.wait()
+            return "<html/>"
+
+        async def preview() -> bytes:
+            return b"<svg/>"
+
+        async def upload_pending() -> tuple[datetime.datetime | None, URL, URL]:
+            async with SmokeshowSite("provided-key") as site:
+                return await upload(site, html_page(), preview())
+
+        result = asyncio.run(asyncio.wait_for(upload_pending(), 5))
+        assert result[1] == URL("https://test.example.com/foobar")
+
+    @pytest.mark.usefixtures("create_response")
+    def test_upload_minified(
+        self,
+        upload_response_factory: UploadResponseFactory,
+        capsys: pytest.CaptureFixture[str],
+    ) -> None:
+        upload_response_factory("index.html")
+        upload_response_factory("preview.svg")
+        asyncio.run(_upload("provided-key", Minified("<html/>", 2048), b"<svg/>"))
+        assert "Uploaded index.html (example/mock-type, 1.2 KiB, saved 2.0 KiB," in (
+            capsys.readouterr().out
+        )
+
+    @pytest.mark.usefixtures("create_response")
+    def test_upload_empty_pool(
+        self,
+        tmp_path: Path,
+        upload_response_factory: UploadResponseFactory,
+    ) -> None:
+        self.mock_generate_key.return_value = "random-generated-test-key"
+        pool = SmokeshowKeyPool(tmp_path / "keys.txt")
+        upload_response_factory("index.html")
+        upload_response_factory("preview.svg")
+        asyncio.run(_upload(None, "<html/>", b"<svg/>", key_pool=pool))
+        self.mock_generate_key.assert_called_once_with(stop=ANY)
+
+    @pytest.mark.usefixtures("create_response")
+    def test_upload_concurrency(self) -> None:
+        active = peak = 0
+
+        async def post(
+            name: str, data: bytes, headers: dict[str, str]
+        ) -> tuple[URL, SmokeshowUploadResponse]:
+            nonlocal active, peak
+            active += 1
+            peak = max(peak, active)
+            await asyncio.sleep(0.01)
+            active -= 1
+            response = SmokeshowUploadResponse(
+                path=name,
+                content_type=headers[hdrs.CONTENT_TYPE],
+                size=len(data),
+                total_site_size=1000,
+            )
+            return URL(f"https://test.example.com/foobar/{name}"), response
+
+        async def upload_files() -> UploadStats:
+            async with SmokeshowSite("provided-key", max_concurrent_uploads=2) as site:
+                with patch.object(site, "_post", post):
+                    async with asyncio.TaskGroup() as group:
+                        for i in range(6):
+                            group.create_task(
+                                site.upload(f"{i}.txt", b"x" * 100, "text/plain")
+                            )
+                return site.stats
+
+        with patch("typer.echo", autospec=True) as mock_echo:
+            stats = asyncio.run(upload_files())
+
+        assert peak == 2
+        assert (stats.files, stats.bytes_sent, stats.total_site_size) == (6, 600, 1000)
+        assert stats.elapsed > 0
+        mock_echo.assert_called_with(stats)
+        assert str(stats).startswith("Uploaded 6 files (600 Bytes) in ")
+
+    @pytest.mark.usefixtures("create_response")
+    def test_upload_streamed(self, tmp_path: Path) -> None:
+        html_page = "<html>" + "<p>ünïcödé</p>" * 100 + "</html>"
+        path = tmp_path / "preview.svg"
+        path.write_bytes(b"<svg/>")
+        posted: dict[str, tuple[bytes, dict[str, str]]] = {}
+
+        async def post(
+            name: str, data: UploadData, headers: dict[str, str]
+        ) -> tuple[URL, SmokeshowUploadResponse]:
+            with _request_body(data) as body:
+                match body:
+                    case bytes():
+                        content = body
+                    case AsyncIterator():
+                        content = b"".join([chunk async for chunk in body])
+                    case _:
+                        content = body.read()
+            posted[name] = content, headers
+            response = SmokeshowUploadResponse(
+                path=name, content_type="", size=len(content), total_site_size=0
+            )
+            return URL(f"https://test.example.com/foobar/{name}"), response
+
+        async def streamed_upload() -> None:
+            async with SmokeshowSite("provided-key") as site:
+                with patch.object(site, "_post", post):
+                    await site.upload("index.html", html_page, "text/html")
+                    await site.upload("preview.svg", path, "image/svg+xml")
+
+        with (
+            patch("pyright_analysis_action.smokeshow.CHUNK_SIZE", 64),
+            patch("pyright_analysis_action.publish.CHUNK_SIZE", 64),
+        ):
+            asyncio.run(streamed_upload())
+
+        body, headers = posted["index.html"]
+        assert body == html_page.encode()
+        assert headers[hdrs.CONTENT_LENGTH] == str(len(body))
+        body, headers = posted["preview.svg"]
+        assert body == b"<svg/>"
+        assert hdrs.CONTENT_LENGTH not in headers
+
+    def test_upload_concurrency_invalid(self) -> None:
+        with pytest.raises(ValueError):
+            SmokeshowSite("provided-key", max_concurrent_uploads=0)
+
+    def test_key_search_stopped_on_cancel(self) -> None:
+        started = threading.Event()
+        stopped = False
+
+        def generate_key(stop: threading.Event) -> str:
+            nonlocal stopped
+            started.set()
+            stopped = stop.wait(timeout=10)
+            raise KeySearchStopped
+
+        self.mock_generate_key.side_effect = generate_key
+
+        async def cancel_site_creation() -> None:
+            task = asyncio.create_task(SmokeshowSite().__aenter__())
+            await asyncio.to_thread(started.wait)
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+
+        asyncio.run(cancel_site_creation())
+        assert stopped
+
+    def test_create_site_failure(self, aioresponses: AioResponses) -> None:
+        aioresponses.post(SMOKESHOW_CREATE, status=403)
+        site = SmokeshowSite("provided-key")
+        with pytest.raises(ClientResponseError):
+            asyncio.run(site.__aenter__())
+        assert site._client.closed
+
     @pytest.mark.parametrize(
         "exception_or_status",
         (TimeoutError(), ClientConnectionError(), 500),
@@ -196,7 +494,7 @@ class TestSmokeshowUpload:
 
         # when retrying, don't _actually_ wait.
         with patch("tenacity.wait.wait_exponential_jitter.__call__", return_value=0.0):
-            result = asyncio.run(upload(None, "<html/>", b"<svg/>"))
+            result = asyncio.run(_upload(None, "<html/>", b"<svg/>"))
 
         assert result[1] == URL("https://test.example.com/foobar")
         assert result[2] == URL("https://test.example.com/foobar/preview.svg")
@@ -0,0 +1,75 @@
+import xml.etree.ElementTree as ET
+from pathlib import Path
+
+import plotly.graph_objects as go  # pyright: ignore[reportMissingTypeStubs]
+import pytest
+
+from pyright_analysis_action._report import load_report, to_treemap
+from pyright_analysis_action._svg import _Rect, render_svg, squarify
+
+SVG = "{http://www.w3.org/2000/svg}"
+
+
+def test_squarify() -> None:
+    # the example from the squarified treemaps paper
+    tiles = squarify([6, 6, 4, 3, 2, 2, 1], _Rect(0, 0, 6, 4))
+    assert [t.width * t.height for t in tiles] == pytest.approx([6, 6, 4, 3, 2, 2, 1])
+    assert tiles[:2] == [_Rect(0, 0, 3, 2), _Rect(0, 2, 3, 2)]
+    for tile in tiles:
+        assert 0 <= tile.x and tile.x + tile.width <= 6 + 1e-9
+        assert 0 <= tile.y and tile.y + tile.height <= 4 + 1e-9
+
+
+def test_squarify_empty() -> None:
+    assert squarify([0, 0], _Rect(1, 2, 3, 4)) == [_Rect(1, 2, 0, 0)] * 2
+
+
+@pytest.mark.parametrize("branchvalues", ("total", "remainder"))
+def test_render_svg(branchvalues: str) -> None:
+    values = [10, 4, 6, 6] if branchvalues == "total" else [0, 4, 0, 6]
+    figure = go.Figure(
+        go.Treemap(
+            ids=["foo", "foo.bar", "foo.spam", "foo.spam.ham"],
+            labels=["foo", "bar", "spam", "<ham>"],
+            parents=["", "foo", "foo", "foo.spam"],
+            values=values,
+            branchvalues=branchvalues,
+            marker={"colors": [0.5, 0, 1, 1], "colorscale": "RdYlGn"},
+        ),
+        layout={"width": 400, "height": 300, "title": {"text": "Foo"}},
+    )
+    svg = ET.fromstring(render_svg(figure, scale=0.5))
+    assert (svg.get("width"), svg.get("height")) == ("200", "150")
+    assert svg.get("viewBox") == "0 0 400 300"
+    texts = [text.text for text in svg.iter(f"{SVG}text")]
+    assert texts == ["Foo", "foo", "bar", "spam", "<ham>"]
+    rects = svg.findall(f"{SVG}rect")[1:]  # skip the background
+    assert len(rects) == 4
+    assert rects[2].get("fill") == rects[3].get("fill") != rects[1].get("fill")
+
+
+def test_render_svg_no_treemap() -> None:
+    svg = ET.fromstring(render_svg(go.Figure()))
+    assert [el.tag for el in svg] == [f"{SVG}rect"]
+
+
+def test_render_svg_report(tmp_path: Path, pyright_json_report: str) -> None:
+    path = tmp_path / "report.json"
+    path.write_text(pyright_json_report)
+    svg = ET.fromstring(render_svg(to_treemap(load_report(path))))
+    # the title annotation, not the attribution in the layout title
+    texts = [text.text for text in svg.iter(f"{SVG}text")]
+    assert texts[0] == "Pyright type completeness report for foobar"
+    assert not any("Generated with" in (text or "") for text in texts)
+    # colored from the layout color axis, from red to green
+    fills = [rect.get("fill") for rect in svg.findall(f"{SVG}rect")[1:]]
+    assert fills == ["rgb(165,0,38)", "rgb(0,104,55)"]
+
+
+def test_render_svg_markup() -> None:
+    figure = go.Figure(
+        go.Treemap(ids=["foo"], labels=["foo"], parents=[""]),
+        layout={"title": {"text": "<b>Foo</b> &amp; <a href='#'>bar</a>"}},
+    )
+    svg = ET.fromstring(render_svg(figure))
+    assert svg.find(f"{SVG}text").text == "Foo & bar"  # pyright: ignore[reportOptionalMemberAccess]